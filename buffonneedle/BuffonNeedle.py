@@ -1,9 +1,13 @@
 from PIL import Image, ImageDraw
 import math
 import argparse
-import random
+import hashlib
+import multiprocessing
 import numpy as np
 
+#Number of strata of the angle and of the offset of the stratified sampler
+strata = 16
+
 #Create parser for command line arguments
 def getCommandLineParser():
  parser = argparse.ArgumentParser(description='Paint simulations of the Buffon Needle problem.')
@@ -11,9 +15,27 @@ def getCommandLineParser():
  parser.add_argument('-l', default='100', help='Length of the needle', type=int)
  parser.add_argument('-n', default='300', help='Number of needles thrown in each simulation', type=int)
  parser.add_argument('-m', default='1', help='Number of simulations', type=int)
+ parser.add_argument('-b', default='3', help='Number of vertical bars of the board', type=int)
+ parser.add_argument('-c', default='1000000', help='Number of needles thrown at once by the estimator', type=int)
+ parser.add_argument('-d', default='300', help='Number of needles drawn on the image, sampled apart from the estimate. 0 to skip the image', type=int)
+ parser.add_argument('-r', help='Master seed of the random streams of the simulations', type=int, required=False)
+ parser.add_argument('-j', help='Number of worker processes, all cores by default', type=int, required=False)
+ parser.add_argument('-e', help='Run a single simulation until the confidence interval of pi has this half-width, with -n as the largest number of needles', type=float, required=False)
+ parser.add_argument('-z', default='1.96', help='Number of standard errors of the confidence interval half-width', type=float)
+ parser.add_argument('-v', default='plain', help='Sampler of the needles: [plain|antithetic|stratified]', type=str)
+ parser.add_argument('-H', help='Draw the needles as a density heatmap, for a large number of them', action='store_true')
+ parser.add_argument('-o', help='File name to save the image (.png)', type=str, required=False)
+ parser.add_argument('--trace', help='File name to save the convergence trace (.csv) of -e', type=str, required=False)
  return parser
 
-def paintBars(image, t, l):
+#Number of needle points rasterized at once by the heatmap
+heatmapPoints = 4000000
+
+def boardSize(t, l, bars):
+ """Size of the board: the bars, plus allow margin for the borders"""
+ return (bars - 1) * t + 2 * l
+
+def paintBars(image, t, l, bars = 3):
  """Draw the vertical bars on the image"""
  
  #Define color for the bars
@@ -24,11 +46,146 @@ def paintBars(image, t, l):
 
  #Effectively draw the vertical lines
  size = image.size[0]
- draw.line([(l,0), (l, size)], white)
- draw.line([(l + t,0), (l + t, size)], white)
- draw.line([(l + 2 * t,0), (l + 2 * t, size)], white)
+ for i in range(0, bars):
+  draw.line([(l + i * t,0), (l + i * t, size)], white)
  
-def throwNeedle(image, n, t, l):
+def unitSize(sampler):
+ """Number of needles of the independent units of a sampler: single needles,"""
+ """antithetic pairs or sweeps over every stratum"""
+ return { 'plain' : 1, 'antithetic' : 2, 'stratified' : strata * strata }[sampler]
+
+def throwNeedles(rng, n, size, t, l, sampler = 'plain', bars = 3):
+ """Throw n needles in the simulation board with the numpy random generator rng"""
+ """Return the arrays of the end points xA, yA, xB, yB of the needles"""
+
+ #Generate the alpha angle and the position of the center of the needle
+ #The center falls within half a distance between lines of one of the
+ #bars, so every bar sees needles centered on a band of width t around it
+ y = rng.uniform(0, size, n)
+ (x0, x1) = (l - t / 2.0, l + (bars - 0.5) * t)
+ if sampler == 'plain':
+  x = rng.uniform(x0, x1, n)
+  alpha = rng.uniform(0, math.pi / 2.0, n)
+ elif sampler == 'antithetic':
+  #Pairs of needles with angles alpha and pi/2 - alpha, and centers at
+  #distances d and t/2 - d of the nearest bar: one crosses when the other
+  #is unlikely to
+  half = (n + 1) // 2
+  x = rng.uniform(x0, x1, half)
+  x = np.column_stack( (x, x0 + (x - x0 + t / 2.0) % (x1 - x0)) ).ravel()[:n]
+  alpha = rng.uniform(0, math.pi / 2.0, half)
+  alpha = np.column_stack( (alpha, math.pi / 2.0 - alpha) ).ravel()[:n]
+ elif sampler == 'stratified':
+  #Needle k falls on the stratum k of the grid of offsets and angles. A
+  #last partial sweep falls on a random subset of the strata, so every
+  #needle is still uniform on the board whatever n is
+  k = np.arange(n) % (strata * strata)
+  rest = n % (strata * strata)
+  if rest > 0:
+   k[n - rest:] = rng.permutation(strata * strata)[:rest]
+  x = x0 + (k // strata + rng.uniform(0, 1, n)) * (x1 - x0) / strata
+  alpha = (k % strata + rng.uniform(0, 1, n)) * (math.pi / 2.0) / strata
+ else:
+  raise Exception("Sampler parameter [plain|antithetic|stratified]")
+
+ #Points of the needle
+ (dx, dy) = (l / 2.0 * np.sin( alpha ), l / 2.0 * np.cos( alpha ))
+ return (x - dx, y - dy, x + dx, y + dy)
+
+def touching(xA, xB, t, l):
+ """Check which needles, with end points at xA and xB, touch a vertical bar"""
+
+ #Bars are at x = l + k * t, so a needle touches one when its end points lie
+ #between different pairs of bars. This holds for any number of bars, and
+ #for the lines beyond the board reached by needles longer than t
+ return np.floor( (xA - l) / t ) != np.floor( (xB - l) / t )
+
+def countTouches(rng, n, t, l, chunk, sampler = 'plain', bars = 3):
+ """Throw n needles, chunk at a time so memory does not grow with n"""
+ """Return the number of needles touching one of the bars"""
+
+ size = boardSize(t, l, bars)
+ unit = unitSize(sampler)
+ chunk = max(unit, chunk // unit * unit)
+ touch_count = 0
+ for start in xrange(0, n, chunk):
+  (xA, yA, xB, yB) = throwNeedles(rng, min(chunk, n - start), size, t, l, sampler, bars)
+  touch_count += int( np.count_nonzero( touching(xA, xB, t, l) ) )
+ return touch_count
+
+def crossingFactor(t, l):
+ """Probability of a needle touching a bar, times pi / 2: l / t for needles"""
+ """not longer than the distance between lines, the long needle formula else"""
+ if l <= t:
+  return float(l) / t
+ r = float(t) / l
+ return (1.0 - math.sqrt(1.0 - r * r)) / r + math.acos(r)
+
+def estimatePi(n, touch_count, t, l):
+ """Estimate of pi from the number of needles touching a bar"""
+ if touch_count == 0:
+  return float('inf')
+ return 2.0 * crossingFactor(t, l) * n / touch_count
+
+def mergeVariance(state, count, mean, m2):
+ """Merge the count, mean and sum of squared deviations of a chunk of samples"""
+ """into the running state (count, mean, m2), as Welford's online algorithm"""
+ (n, running_mean, running_m2) = state
+ total = n + count
+ delta = mean - running_mean
+ return (total, running_mean + delta * count / total, running_m2 + m2 + delta * delta * n * count / total)
+
+def piError(state, t, l):
+ """Estimate of pi and its standard error from the running state of the"""
+ """touch indicators of the needles, through the delta method"""
+ (n, mean, m2) = state
+ if mean == 0 or n < 2:
+  return (float('inf'), float('inf'))
+ pi_estimate = 2.0 * crossingFactor(t, l) / mean
+ return (pi_estimate, pi_estimate * math.sqrt(m2 / (n - 1) / n) / mean)
+
+def effectiveSize(state):
+ """Number of plain needles whose estimate has the variance of the running state"""
+ (n, mean, m2) = state
+ if n < 2 or m2 == 0:
+  return float('inf')
+ return mean * (1.0 - mean) * n * (n - 1) / m2
+
+def converge(args, trace = None):
+ """Throw needles by chunks until the confidence interval of pi is narrower"""
+ """than the requested half-width, or n needles were thrown"""
+ """Write a csv row throws, estimate, stderr on trace after each chunk"""
+ """The running state holds the touch frequency of each unit of the sampler"""
+ """Return the number of needles thrown, the estimate, its error and the"""
+ """effective sample size"""
+ (t, l, n, sampler) = (args['t'], args['l'], args['n'], args['v'])
+ rng = streamGenerator(args['r'], 0)
+ size = boardSize(t, l, args['b'])
+ unit = unitSize(sampler)
+ chunk = max(unit, args['c'] // unit * unit)
+
+ if trace is not None:
+  trace.write('throws,estimate,stderr\n')
+
+ state = (0, 0.0, 0.0)
+ (pi_estimate, error) = (float('inf'), float('inf'))
+ while (state[0] + 1) * unit <= n:
+  count = min(chunk, (n - state[0] * unit) // unit * unit)
+  (xA, yA, xB, yB) = throwNeedles(rng, count, size, t, l, sampler, args['b'])
+  units = touching(xA, xB, t, l).reshape(-1, unit).mean(axis = 1)
+
+  mean = units.mean()
+  state = mergeVariance(state, len(units), mean, float( np.sum( (units - mean)**2 ) ))
+  (pi_estimate, error) = piError(state, t, l)
+
+  if trace is not None:
+   trace.write('%d,%r,%r\n' % (state[0] * unit, pi_estimate, error))
+  if args['z'] * error <= args['e']:
+   break
+
+ return (state[0] * unit, pi_estimate, error, effectiveSize(state))
+
+def throwNeedle(image, n, t, l, rng = np.random, bars = 3):
  """Throw n needles in the simulation board"""
  """Paint in red needles touching one of the bars"""
  
@@ -36,43 +193,88 @@ def throwNeedle(image, n, t, l):
  green = (0, 255, 0)
  red = (255, 0, 0)
  
- #x coordenate of bar positions
- bar_pos = [l, l + t, l + 2 * t]
  size = image.size[0]
  
- #Count the number of touchs
- touch_count = 0
- 
  #Draw object to draw lines
  draw = ImageDraw.Draw(image)
   
  #Create the n simulations
- for i in range(0, n):  
-  #Generate the alpha angle and the position of the center of the needle 
-  y = random.randint(0, size)
-  x = random.randint(0, size)
-  alpha = random.uniform(0, math.pi / 2.0 )
- 
-  #Points of the needle
-  pointB = (x + l / 2 * math.sin( alpha ), y + l / 2 * math.cos( alpha ) )
-  pointA = (x - l / 2 * math.sin( alpha ), y - l / 2 * math.cos( alpha ) )
- 
-  #Check if the needle touch a vertical bar
-  (xA, xB) = (pointA[0], pointB[0])
-  touch = ( xA < bar_pos[0] and xB > bar_pos[0] ) or \
-      ( xA < bar_pos[1] and xB > bar_pos[1] ) or \
-      ( xA < bar_pos[2] and xB > bar_pos[2] )
-
-  #Draw the needle
-  if touch:
-   draw.line( (pointA, pointB), red)
-   touch_count += 1
-  else:
-   draw.line( (pointA, pointB), green)
+ (xA, yA, xB, yB) = throwNeedles(rng, n, size, t, l, 'plain', bars)
+ touch = touching(xA, xB, t, l)
+
+ #Draw the needles
+ for i in range(0, n):
+  draw.line( ((xA[i], yA[i]), (xB[i], yB[i])), red if touch[i] else green)
   
- pi_estimate = float( 2.0 * l * n) / float(t * touch_count)
- 
- return pi_estimate
+ return estimatePi(n, int( np.count_nonzero(touch) ), t, l)
+
+def heatmapNeedles(image, n, t, l, rng = np.random, bars = 3):
+ """Throw n needles in the simulation board and paint their density"""
+ """Red is the density of needles touching one of the bars, green of the others"""
+
+ size = image.size[0]
+
+ #Number of needles hitting each pixel, for needles touching a bar or not
+ hits = np.zeros((2, size * size), dtype=np.int64)
+
+ #Points along each needle, less than a pixel apart
+ points = int( math.ceil(l) ) + 1
+ steps = np.linspace(0.0, 1.0, points)
+ chunk = max(1, heatmapPoints // points)
+
+ touch_count = 0
+ for start in xrange(0, n, chunk):
+  (xA, yA, xB, yB) = throwNeedles(rng, min(chunk, n - start), size, t, l, 'plain', bars)
+  touch = touching(xA, xB, t, l)
+  touch_count += int( np.count_nonzero(touch) )
+  x = np.floor( xA[:, None] + (xB - xA)[:, None] * steps ).astype(np.int64)
+  y = np.floor( yA[:, None] + (yB - yA)[:, None] * steps ).astype(np.int64)
+  inside = (0 <= x) & (x < size) & (0 <= y) & (y < size)
+  pixel = y * size + x
+  for channel, needles in enumerate( (touch, ~touch) ):
+   hit = inside & needles[:, None]
+   hits[channel] += np.bincount( pixel[hit], minlength = size * size )
+
+ #Log scale of the densities
+ rgb = np.zeros((size, size, 3), dtype=np.uint8)
+ for channel in (0, 1):
+  density = np.log1p( hits[channel] )
+  if density.max() > 0:
+   rgb[:, :, channel] = (255.0 * density / density.max()).reshape(size, size).astype(np.uint8)
+ image.paste( Image.fromarray(rgb) )
+
+ return estimatePi(n, touch_count, t, l)
+
+def streamGenerator(seed, index):
+ """Numpy random generator of the independent stream number index of a master seed"""
+ """The stream only depends on seed and index, not on the process running it"""
+ digest = hashlib.sha256( '%d:%d' % (seed, index) ).digest()
+ return np.random.RandomState( np.frombuffer(digest, dtype=np.uint32) )
+
+def simulate(args, indices):
+ """Run the simulations of the given indices, each one on its own stream"""
+ """Return their touch counts, the only data sent back by the workers"""
+ return [ countTouches(streamGenerator(args['r'], i), args['n'], args['t'], args['l'], args['c'], args['v'], args['b']) for i in indices ]
+
+def simulateAll(args):
+ """Run the m simulations on a pool of worker processes, or on this"""
+ """process for a single simulation or worker"""
+ """Return the touch count of each simulation, in order"""
+ m = args['m']
+ workers = args['j'] if args['j'] is not None else multiprocessing.cpu_count()
+ if m == 1 or workers == 1:
+  return simulate(args, range(0, m))
+
+ #Blocks of simulations, a few per worker so they stay balanced
+ block = max(1, -(-m // (4 * workers)))
+ blocks = [ range(i, min(i + block, m)) for i in range(0, m, block) ]
+ pool = multiprocessing.Pool(workers)
+ try:
+  counts = [ pool.apply_async(simulate, (args, indices)) for indices in blocks ]
+  return [ count for block_counts in counts for count in block_counts.get() ]
+ finally:
+  pool.terminate()
+  pool.join()
  
 def main():
  #Parse command line arguments
@@ -85,32 +287,74 @@ def main():
  l = args['l']
  n = args['n']
  m = args['m']
+ drawn = args['d']
+
+ #Draw a master seed, shown so the simulation can be reproduced
+ if args['r'] is None:
+  args['r'] = int( np.random.randint(0, 2**31) )
+
+ #Run a single simulation until the estimate is precise enough
+ if args['e'] is not None:
+  print "Sampler: ", args['v']
+  print "Converging to a confidence interval half-width of ", args['e'], " with at most ", n, " needles."
+  trace = open(args['trace'], 'w') if args['trace'] is not None else None
+  (throws, pi_estimate, error, effective) = converge(args, trace)
+  if trace is not None:
+   trace.close()
+  print "Throws: ", throws, " Seed: ", args['r']
+  print "Estimate: ", pi_estimate, " +- ", args['z'] * error
+  print "Std error: ", error
+  print "Effective sample size: ", effective
+  return
 
  #Description of the simulation
  print "Starting simulation for ", n, " needles."
- print "Distance between lines: ", t, " Needle Length: ", l
-
- #Create the bitmap containing the DLA result
- image_size = t * 2 + 2 * l #Draw three vertical lines, plus allow margin for the borders
- img = Image.new( 'RGB', (image_size, image_size), "black")
+ print "Distance between lines: ", t, " Needle Length: ", l, " Bars: ", args['b']
+ print "Simulations: ", m, " Seed: ", args['r'], " Sampler: ", args['v']
 
  #Array with estimates of pi for each simulation
  estimates = np.zeros(m)
- 
- #Draw the vertical lines
- paintBars(img, t, l)
 
- #Simulate m times
- for i in range(0, m):
-  #Throw needle n times
-  estimates[i] = throwNeedle(img, n, t, l)
+ #Simulate m times in parallel, without drawing
+ touch_counts = simulateAll(args)
+ for i, touch_count in enumerate( touch_counts ):
+  estimates[i] = estimatePi(n, touch_count, t, l)
      
  print "Mean: ", np.mean( estimates )
  print "Std: ", np.std( estimates )
+
+ #Number of plain needles whose touch frequency would vary as much as the
+ #ones of the simulations
+ if m > 1:
+  frequencies = np.array(touch_counts, dtype=float) / n
+  p = np.mean(frequencies)
+  variance = np.var(frequencies, ddof = 1)
+  print "Effective sample size: ", p * (1.0 - p) / variance if variance > 0 else float('inf')
+
+ if drawn == 0:
+  return
+
+ #Create the bitmap containing the DLA result
+ image_size = boardSize(t, l, args['b'])
+ img = Image.new( 'RGB', (image_size, image_size), "black")
+
+ #Draw a sample of needles, apart from the estimates, on the stream after
+ #the ones of the simulations
+ if args['H']:
+  heatmapNeedles(img, drawn, t, l, streamGenerator(args['r'], m), args['b'])
+ else:
+  throwNeedle(img, drawn, t, l, streamGenerator(args['r'], m), args['b'])
+ 
+ #Draw the vertical lines
+ paintBars(img, t, l, args['b'])
  
  #Show the result
  img = img.transpose(Image.FLIP_TOP_BOTTOM)
  img.show()
+
+ #Save the image if we specified an output file
+ if args['o'] is not None:
+  img.save(args['o'])
   
 if __name__ == "__main__":
  main()
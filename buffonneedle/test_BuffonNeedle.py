@@ -0,0 +1,44 @@
+import math
+import unittest
+import numpy as np
+import BuffonNeedle as buffon
+
+#Seeded checks of the samplers of the estimator, run from this directory
+#with python -m unittest test_BuffonNeedle
+
+def touchFrequency(sampler, t, l, bars, n, runs, seed = 0):
+ """Frequency of the needles touching a bar over runs simulations of n needles"""
+ rng = np.random.RandomState(seed)
+ touches = sum( buffon.countTouches(rng, n, t, l, 1000000, sampler, bars) for i in range(0, runs) )
+ return float(touches) / (n * runs)
+
+class SamplerTest(unittest.TestCase):
+
+ #Short and long needles, on boards of one and several bars
+ geometries = ( (200, 100, 1), (200, 100, 3), (100, 250, 2), (100, 250, 5) )
+
+ def checkSampler(self, sampler, n, runs):
+  """Every geometry touches with the exact probability, within 4 standard"""
+  """errors of plain needles, an upper bound of the error of every sampler"""
+  for t, l, bars in self.geometries:
+   exact = buffon.crossingFactor(t, l) * 2.0 / math.pi
+   frequency = touchFrequency(sampler, t, l, bars, n, runs)
+   tolerance = 4.0 * math.sqrt( exact * (1.0 - exact) / (n * runs) )
+   self.assertLess( abs(frequency - exact), tolerance, (sampler, t, l, bars, frequency, exact) )
+
+ def testPlain(self):
+  self.checkSampler('plain', 300, 10000)
+
+ def testAntithetic(self):
+  self.checkSampler('antithetic', 301, 10000)
+
+ #300 needles are a whole sweep of the 16 x 16 strata and a partial one
+ def testStratified(self):
+  self.checkSampler('stratified', 300, 10000)
+
+ def testStratifiedWholeSweeps(self):
+  self.checkSampler('stratified', 2 * buffon.unitSize('stratified'), 5000)
+
+
+if __name__ == "__main__":
+ unittest.main()
@@ -0,0 +1,156 @@
+import Image
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import multiprocessing
+import diffusionlimitedaggregation as dla
+
+#Benchmark of the DLA engines: every combination of engine, lattice size,
+#particle fraction, frame shape and launch is simulated with a fixed seed
+#on its own process, so the peak RSS of each run is measured apart. Each
+#record has the particles per second of the timed run and the mean walk
+#length, in random moves per particle (a jump of the jump engine is a
+#move), counted on a second run replaying the same seed. The timed run
+#is never slowed down by the counting
+
+#Columns of the csv records
+fields = ('engine', 'size', 'fraction', 'frame', 'launch', 'seed', 'particles',
+	'seconds', 'particles_per_second', 'mean_walk_length', 'peak_rss_kb')
+
+#Create parser for command line arguments
+def getCommandLineParser():
+	parser = argparse.ArgumentParser(description='Benchmark the Diffusion Limited Aggregation engines.')
+	parser.add_argument('-e', default='image,grid,jump,batch', help='Comma separated engines: [grid|jump|batch|image]', type=str)
+	parser.add_argument('-s', default='200,500,1000,2000', help='Comma separated lattice sizes', type=str)
+	parser.add_argument('-p', default='0.01,0.05', help='Comma separated fractions of particles of the total number of sites', type=str)
+	parser.add_argument('-f', default='bottom,origin', help='Comma separated frame shapes: [bottom|square|circle|origin]', type=str)
+	parser.add_argument('-l', default='uniform', help='Comma separated launch modes of the lattice engines: [uniform|circle]', type=str)
+	parser.add_argument('-r', default='0', help='Seed of the random generator of every run', type=int)
+	parser.add_argument('-o', help='File name to save the records (.csv or .jsonl), json lines on stdout by default', type=str, required=False)
+	parser.add_argument('--image-limit', default='200', help='Largest lattice size simulated by the image engine, far slower than the others', type=int)
+	parser.add_argument('--no-walks', help='Skip the second run counting the walk length', action='store_true')
+	return parser
+
+#Random generator counting its draws, which are one per move of the walks
+class CountingRandom(random.Random):
+
+	def __init__(self, seed):
+		random.Random.__init__(self, seed)
+		self.draws = 0
+
+	def random(self):
+		self.draws += 1
+		return random.Random.random(self)
+
+#Launcher counting the draws spent launching walkers, which are not moves
+class CountingLauncher(object):
+
+	def __init__(self, launcher, rng):
+		self.launcher = launcher
+		self.rng = rng
+		self.draws = 0
+
+	def __getattr__(self, name):
+		return getattr(self.launcher, name)
+
+	def launch(self, rand):
+		draws = self.rng.draws
+		position = self.launcher.launch(rand)
+		self.draws += self.rng.draws - draws
+		return position
+
+#Simulate with the image engine, normalSimulation. Return the number of
+#particles stuck and the random moves, one draw each besides the draw
+#picking the start of each particle
+def imageRun(args, n_particles, rng):
+	img = Image.new( 'RGB', (args['s'], args['s']), "black")
+	pixels = img.load()
+	dla.paintFrame(pixels, args['s'], args['f'])
+
+	colors = list( dla.colour.Color("red").range_to(dla.colour.Color("blue"), dla.nColors) )
+	dla.normalSimulation(pixels, n_particles, args['s'], colors, None, rng)
+	if isinstance(rng, CountingRandom):
+		return (n_particles - 1, rng.draws - (n_particles - 1))
+	return (n_particles - 1, None)
+
+#Simulate with one of the lattice engines. Return the number of particles
+#stuck and the random moves, not counted for the batch engine, which moves
+#its walkers with numpy
+def latticeRun(args, n_particles, rng):
+	(lattice, launcher) = dla.createLattice(args)
+	if not isinstance(rng, CountingRandom) or args['e'] == 'batch':
+		dla.runLattice(args, lattice, launcher, n_particles, rng, True)
+		return (lattice.count, None)
+	launcher = CountingLauncher(launcher, rng)
+	dla.runLattice(args, lattice, launcher, n_particles, rng, True)
+	return (lattice.count, rng.draws - launcher.draws)
+
+#Benchmark one configuration, on a process of its own
+def benchmark(config, walks):
+	args = vars( dla.getCommandLineParser().parse_args([]) )
+	args.update(config)
+	n_particles = dla.getParticles(args)
+	run = imageRun if args['e'] == 'image' else latticeRun
+
+	start = time.time()
+	(particles, moves) = run(args, n_particles, random.Random(args['r']))
+	seconds = time.time() - start
+
+	#Same simulation again, counting the moves of the walks
+	if walks:
+		(particles, moves) = run(args, n_particles, CountingRandom(args['r']))
+
+	return { 'engine' : args['e'], 'size' : args['s'], 'fraction' : args['p'], 'frame' : args['f'],
+		'launch' : args['l'], 'seed' : args['r'], 'particles' : particles, 'seconds' : seconds,
+		'particles_per_second' : particles / seconds if seconds > 0 else None,
+		'mean_walk_length' : float(moves) / particles if moves is not None and particles > 0 else None,
+		'peak_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss }
+
+#Configurations to benchmark from the command line arguments. The image
+#engine only launches walkers from free sites and is limited in size
+def getConfigs(args):
+	configs = []
+	for engine in args['e'].split(','):
+		for size in [ int(s) for s in args['s'].split(',') ]:
+			if engine == 'image' and size > args['image_limit']:
+				continue
+			for fraction in [ float(p) for p in args['p'].split(',') ]:
+				for frame in args['f'].split(','):
+					for launch in args['l'].split(','):
+						if engine == 'image' and launch != 'uniform':
+							continue
+						configs.append( { 'e' : engine, 's' : size, 'p' : fraction, 'f' : frame, 'l' : launch, 'r' : args['r'] } )
+	return configs
+
+def main():
+	#Parse command line arguments
+	parser = getCommandLineParser()
+	args = vars( parser.parse_args() )
+
+	if args['o'] is None:
+		(stream, jsonl) = (sys.stdout, True)
+	else:
+		(stream, jsonl) = (open(args['o'], 'w'), args['o'].endswith('.jsonl'))
+	if not jsonl:
+		stream.write( ','.join(fields) + '\n' )
+
+	#A fresh process per configuration, so its peak RSS is its own
+	for config in getConfigs(args):
+		pool = multiprocessing.Pool(1)
+		try:
+			record = pool.apply(benchmark, (config, not args['no_walks']))
+		finally:
+			pool.terminate()
+			pool.join()
+		if jsonl:
+			stream.write( json.dumps(record) + '\n' )
+		else:
+			stream.write( ','.join( '' if record[key] is None else str(record[key]) for key in fields ) + '\n' )
+		stream.flush()
+
+
+if __name__ == "__main__":
+  main()
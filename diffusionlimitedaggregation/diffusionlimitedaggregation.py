@@ -1,13 +1,25 @@
 import Image
 import colour
+import os
+import sys
+import zlib
+import json
+import math
+import struct
+import time
 import random
+import hashlib
 import argparse
+import multiprocessing
+import numpy as np
 from progressbar import *
 
 #TODO:
 #See other nice ideas at http://bit-player.org/
 #Define adjacency matrix for the next move and for neighbourhood check
 #so that we can generate different brownian tree configuration
+#An off-lattice configuration is available on offlattice.py
+#A 3D version on a voxel volume is available on voxel.py
 
 #the adjacency matrix for movements and neighbourhood check
 adjacency = [(i,j) for i in (-1,0,1) for j in (-1,0,1) if not (i == j == 0)] 
@@ -18,6 +30,39 @@ nColors = 100
 #Number of steps in the progress bar
 steps = 100
 
+#Command line arguments defining a simulation, restored from checkpoints
+simulationArgs = ('s', 'n', 'p', 'f', 'e', 'l', 'k', 'lattice')
+
+#Site flags of the occupancy lattice. A site is sticky when it is free
+#but has an occupied site among its adjacent ones. Walkers reaching a
+#kill site have wandered too far from the cluster and are relaunched
+EMPTY = 0
+OCCUPIED = 1
+STICKY = 2
+KILL = 4
+
+#Distance in pixels between the cluster and the launch circle
+launchMargin = 5
+
+#Slack on the kill radius, so the kill sites are not rebuilt at every growth
+killSlack = 1.25
+
+#Cap of the distance map used by jump walks, in pixels
+jumpCap = 32
+
+#Bins per octave of the mass-radius histogram of the cluster metrics
+binsPerOctave = 4
+
+#Smallest radius used to fit the fractal dimension
+dimensionRadius = 10.0
+
+#Number of rows processed at once on the bit packed lattice
+bandRows = 256
+
+#Largest density of concurrent walkers inside the kill radius of the batch
+#engine. Crowded walkers make the clusters compact instead of fractal
+batchDensity = 0.01
+
 #Create parser for command line arguments
 def getCommandLineParser():
 	parser = argparse.ArgumentParser(description='Paint a brownian tree using Diffusion Limited Aggregtion simulation.')
@@ -26,13 +71,32 @@ def getCommandLineParser():
 	parser.add_argument('-p', help='Fraction of particles of the total number of pixel on the image', type=float, required=False)
 	parser.add_argument('-o', help='File name to save the image (.png)', type=str, required=False)	
 	parser.add_argument('-f', default='bottom', help='Frame shape where particles can stick: [bottom|square|circle|origin]', type=str, required=False)	
+	parser.add_argument('-e', default='grid', help='Simulation engine: [grid|jump|batch|offlattice|image]', type=str, required=False)
+	parser.add_argument('-w', default='1000', help='Number of concurrent walkers of the batch engine', type=int, required=False)
+	parser.add_argument('--step', default='1.0', help='Step length of the off-lattice walkers, in particle diameters', type=float, required=False)
+	parser.add_argument('-r', help='Seed of the random generator', type=int, required=False)
+	parser.add_argument('-N', help='Run an ensemble of N independent clusters instead of a single image', type=int, required=False)
+	parser.add_argument('-d', default='ensemble', help='Output directory of the ensemble', type=str, required=False)
+	parser.add_argument('-j', help='Number of worker processes of the ensemble, all cores by default', type=int, required=False)
+	parser.add_argument('--lattice', default='bytes', help='Lattice of the grid and batch engines: [bytes|bits]. bits packs 1 bit per site and writes the image in bands', type=str, required=False)
+	parser.add_argument('--memmap', help='Directory where the bits lattice keeps its arrays as memory mapped files', type=str, required=False)
+	parser.add_argument('--metrics', help='File where cluster metrics are streamed while simulating (.csv or .jsonl)', type=str, required=False)
+	parser.add_argument('--metrics-every', default='1000', help='Number of particles between cluster metrics records', type=int, required=False)
+	parser.add_argument('--checkpoint', help='File (.npz) where checkpoints of the grid and jump engines are written', type=str, required=False)
+	parser.add_argument('--checkpoint-every', default='100000', help='Number of particles between checkpoints', type=int, required=False)
+	parser.add_argument('--resume', help='Continue the simulation saved on a checkpoint file', type=str, required=False)
+	parser.add_argument('--headless', help='Never open an image viewer, for machines without display', action='store_true')
+	parser.add_argument('--snapshots', help='Directory where a numbered PNG snapshot of the growth is written every K particles, or - to write raw RGB frames on stdout', type=str, required=False)
+	parser.add_argument('--snapshot-every', default='1000', help='Number of particles K between snapshots', type=int, required=False)
+	parser.add_argument('-l', default='uniform', help='Where walkers are launched: [uniform|circle]. circle launches just outside the cluster (above it for the bottom frame)', type=str, required=False)
+	parser.add_argument('-k', default='2.0', help='Kill radius of the circle launch, as a factor of the launch radius', type=float, required=False)
 	return parser
   
 #Move randomly a particle in a given position
 #Do not bounce on image limits
-def moveParticle(position, size):
+def moveParticle(position, size, rng = random):
 	(x, y) = position
-	(dx, dy) = adjacency[ random.randrange(0, 8) ]
+	(dx, dy) = adjacency[ rng.randrange(0, 8) ]
 	if( 0 <= x + dx < size ):
 		x = x + dx
 	if( 0 <= y + dy < size ): 
@@ -40,9 +104,10 @@ def moveParticle(position, size):
 	return (x, y)	
 
 #Define initial frame where particle can stick 
-def paintFrame(pixels, size, frame):
+#pixels may be a PIL pixel access object or the pixels of a lattice,
+#in which case blank is the value used to mark the frame sites
+def paintFrame(pixels, size, frame, blank = (255, 255, 255)):
 	
-	blank = (255, 255, 255)
 	if frame == 'bottom':
 		for i in range(0, size):
 			pixels[i, 0] = blank
@@ -62,8 +127,8 @@ def paintFrame(pixels, size, frame):
 	
 	elif frame == 'origin':
 		origin_size = 10
-		for i in range(0, origin_size):
-			for j in range(0, origin_size):
+		for i in range(size/2 - origin_size/2, size/2 + origin_size/2 + 1):
+			for j in range(size/2 - origin_size/2, size/2 + origin_size/2 + 1):
 				if (i - size/2)**2 + (j - size/2)**2 <= (origin_size / 2)**2:
 					pixels[i, j] = blank
 	else:
@@ -88,7 +153,8 @@ def adjacentParticle(pixels, size, position):
 	
 #Simulation of DLA by randomly creating a new particle in free positions
 #and then apply a brownian motion on it until hitting another particle
-def normalSimulation(pixels, n_particles, image_size, colors):
+#Metrics of the cluster are updated as each particle sticks, if given
+def normalSimulation(pixels, n_particles, image_size, colors, metrics = None, rng = random):
 	
 	nColors = len( colors )
 	void_pixel = (0,0,0)
@@ -108,7 +174,7 @@ def normalSimulation(pixels, n_particles, image_size, colors):
 	for i in range(1, n_particles):
 		
 		#Get initial position from an empty point
-		position = random.sample( free_points, 1)[0]
+		position = rng.sample( free_points, 1)[0]
 		
 		#Color index depending on the time particle was created
 		colorIndex = int( float(i) / n_particles * nColors )
@@ -116,10 +182,14 @@ def normalSimulation(pixels, n_particles, image_size, colors):
 		
 		#Apply brownian motion until we hit another particle
 		while not adjacentParticle(pixels, image_size, position): 
-			position = moveParticle(position, image_size)
+			position = moveParticle(position, image_size, rng)
 		else:
 			pixels[ position[0], position[1] ] = color
 			
+		#Update the metrics of the cluster
+		if metrics is not None:
+			metrics.add(*position)
+
 		#Remove this new position from the set of empty points
 		free_points.remove( position )
 		
@@ -129,7 +199,896 @@ def normalSimulation(pixels, n_particles, image_size, colors):
 		
 	#Close the progress bar	
 	bar.finish()
-							
+
+#Occupancy lattice of the simulation, indexed as lattice[x, y] like the pixels
+#of the image. Site flags live in a flat bytearray (index x * size + y) so the
+#random walk only does one byte lookup per step, and a numpy view of the same
+#buffer is kept for vectorized operations. The arrival array keeps the order
+#in which each particle stuck, the image is only built at the end from it
+class Lattice(object):
+
+	def __init__(self, size):
+		self.size = size
+		self.sites = bytearray(size * size)
+		self.flags = np.frombuffer(self.sites, dtype=np.uint8).reshape(size, size)
+		self.arrival = np.zeros((size, size), dtype=np.uint32)
+		self.pixels = self.flags
+		self.count = 0
+		self.free = size * size
+		self.distance = None
+
+	#Mark as sticky every free site adjacent to an occupied one
+	#Should be called once the frame has been painted on the flags
+	def updateSticky(self):
+		occupied = self.flags == OCCUPIED
+		self.flags[dilate(occupied) & ~occupied] = STICKY
+		self.free = self.size * self.size - int(np.count_nonzero(occupied))
+
+	#Keep a map with the distance from each site to the closest occupied one,
+	#capped to jumpCap, so that walkers far from the aggregate can jump.
+	#Only occupied sites on the border of the frame need to be stamped
+	def trackDistance(self):
+		size = self.size
+		self.distanceSites = bytearray([jumpCap]) * (size * size)
+		self.distance = np.frombuffer(self.distanceSites, dtype=np.uint8).reshape(size, size)
+		(dx, dy) = np.ogrid[-jumpCap:jumpCap + 1, -jumpCap:jumpCap + 1]
+		self.stamp = np.minimum( np.sqrt(dx**2 + dy**2), jumpCap ).astype(np.uint8)
+		occupied = self.flags == OCCUPIED
+		for x, y in zip( *np.nonzero(occupied & dilate(~occupied)) ):
+			self.stampDistance(x, y)
+
+	#Lower the distance map around a new occupied site
+	def stampDistance(self, x, y):
+		(x0, x1) = ( max(x - jumpCap, 0), min(x + jumpCap + 1, self.size) )
+		(y0, y1) = ( max(y - jumpCap, 0), min(y + jumpCap + 1, self.size) )
+		window = self.distance[x0:x1, y0:y1]
+		np.minimum(window, self.stamp[x0 - x + jumpCap:x1 - x + jumpCap, y0 - y + jumpCap:y1 - y + jumpCap], out=window)
+
+	#Get a random free site where a new particle can start its random walk
+	def randomFreeSite(self, rand):
+		size = self.size
+		sites = self.sites
+		while True:
+			x = int(rand() * size)
+			y = int(rand() * size)
+			if sites[x * size + y] != OCCUPIED:
+				return (x, y)
+
+	#Apply brownian motion from a position until reaching a sticky site
+	#Do not bounce on image limits, like moveParticle
+	#Return None if the walker reached a kill site instead
+	def walk(self, x, y, rand):
+		size = self.size
+		sites = self.sites
+		while sites[x * size + y] < STICKY:
+			(dx, dy) = adjacency[ int(rand() * 8) ]
+			if 0 <= x + dx < size:
+				x += dx
+			if 0 <= y + dy < size:
+				y += dy
+		if sites[x * size + y] == KILL:
+			return None
+		return (x, y)
+
+	#Flag of a site
+	def flag(self, x, y):
+		return self.sites[x * self.size + y]
+
+	#Whether walkers at the positions xs, ys reached sticky or kill sites
+	def stopped(self, xs, ys):
+		return self.flags[xs, ys] >= STICKY
+
+	#Coordinates of the occupied sites
+	def occupiedSites(self):
+		return np.nonzero(self.flags == OCCUPIED)
+
+	#Occupied sites packed as 1 bit per site, with numpy.packbits
+	def occupiedBits(self):
+		return np.packbits(self.flags == OCCUPIED, axis = 1)
+
+	#Flag as kill sites the free sites where outside(x0, x1), a boolean
+	#array for the rows x0 to x1, is set, and free the other ones
+	def markKill(self, outside):
+		flags = self.flags
+		outside = outside(0, self.size)
+		flags[(flags == KILL) & ~outside] = EMPTY
+		flags[(flags == EMPTY) & outside] = KILL
+
+	#Same as walk, but a walker at distance d of the aggregate takes a single
+	#jump to a random point of the circle of radius d - 2 around it, which is
+	#where a brownian motion would first leave that circle. Needs trackDistance
+	#Beyond the capped distance map the launcher gives the clearance to the cluster
+	def jumpWalk(self, x, y, rand, launcher):
+		size = self.size
+		last = size - 1
+		sites = self.sites
+		distance = self.distanceSites
+		(cos, sin, turn) = (math.cos, math.sin, 2.0 * math.pi)
+		while sites[x * size + y] < STICKY:
+			d = distance[x * size + y]
+			if d == jumpCap:
+				d = max(d, launcher.clearance(x, y))
+			r = min(d - 2, x, y, last - x, last - y)
+			if r >= 2:
+				angle = rand() * turn
+				x += int( round(r * cos(angle)) )
+				y += int( round(r * sin(angle)) )
+			else:
+				(dx, dy) = adjacency[ int(rand() * 8) ]
+				if 0 <= x + dx < size:
+					x += dx
+				if 0 <= y + dy < size:
+					y += dy
+		if sites[x * size + y] == KILL:
+			return None
+		return (x, y)
+
+	#Stick a new particle on a sticky site and make its free neighbours sticky
+	def stick(self, x, y):
+		size = self.size
+		sites = self.sites
+		self.count += 1
+		self.free -= 1
+		sites[x * size + y] = OCCUPIED
+		self.arrival[x, y] = self.count
+		for dx, dy in adjacency:
+			if (0 <= x + dx < size) and (0 <= y + dy < size):
+				index = (x + dx) * size + y + dy
+				if sites[index] == EMPTY:
+					sites[index] = STICKY
+		if self.distance is not None:
+			self.stampDistance(x, y)
+
+	#Build the RGB image: frame in white, particles colored by arrival order
+	def image(self, colors, n_particles):
+		table = colorTable(colors)
+		rgb = np.zeros((self.size, self.size, 3), dtype=np.uint8)
+		rgb[self.flags == OCCUPIED] = 255
+		stuck = self.arrival > 0
+		rgb[stuck] = table[ self.arrival[stuck].astype(np.int64) * len(table) // n_particles ]
+		#Numpy arrays are indexed [row, column], that is, [y, x]
+		return Image.fromarray(rgb.transpose(1, 0, 2))
+
+#Occupancy lattice with 1 bit per site, for lattices too large for Lattice.
+#Bits are packed by rows of stride bytes as numpy.packbits does: site (x, y)
+#is bit 128 >> (y & 7) of byte x * stride + (y >> 3). There is a bit plane
+#for the occupied sites, one for the sites where walkers stop (sticky or kill)
+#and one for the kill sites. The arrival order uses the smallest integer type
+#fitting n_particles. With a directory, the occupied and kill bits and the
+#arrival order are numpy.memmap files. The stop bits, read at every step of
+#the walks, are always kept in a bytearray, faster to index than numpy
+class PackedLattice(object):
+
+	def __init__(self, size, n_particles, directory = None):
+		self.size = size
+		self.stride = (size + 7) // 8
+		self.pixels = self
+		self.count = 0
+		self.free = size * size
+		self.distance = None
+
+		self.stopBytes = bytearray(size * self.stride)
+		self.stop = np.frombuffer(self.stopBytes, dtype=np.uint8).reshape(size, self.stride)
+
+		arrival = np.uint16 if n_particles < 2**16 else np.uint32
+		if directory is None:
+			(self.occupiedBytes, self.killBytes) = ( bytearray(size * self.stride), bytearray(size * self.stride) )
+			(self.occupied, self.kill) = [ np.frombuffer(plane, dtype=np.uint8).reshape(size, self.stride)
+				for plane in (self.occupiedBytes, self.killBytes) ]
+			self.arrival = np.zeros((size, size), dtype=arrival)
+		else:
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			(self.occupiedBytes, self.killBytes) = [ np.memmap(os.path.join(directory, name + '.bits'),
+				dtype=np.uint8, mode='w+', shape=(size * self.stride,)) for name in ('occupied', 'kill') ]
+			(self.occupied, self.kill) = [ plane.reshape(size, self.stride) for plane in (self.occupiedBytes, self.killBytes) ]
+			self.arrival = np.memmap(os.path.join(directory, 'arrival.bin'), dtype=arrival, mode='w+', shape=(size, size))
+
+	#Mark a frame site, used by paintFrame
+	def __setitem__(self, position, value):
+		(x, y) = position
+		self.occupiedBytes[x * self.stride + (y >> 3)] |= 128 >> (y & 7)
+
+	#Unpacked rows x0 to x1 of a bit plane as a boolean array
+	def rows(self, plane, x0, x1):
+		return np.unpackbits(plane[x0:x1], axis = 1)[:, :self.size].astype(bool)
+
+	#Mark as sticky every free site adjacent to an occupied one, by bands
+	#of rows with one extra row on each side
+	def updateSticky(self):
+		occupied = 0
+		for x0 in range(0, self.size, bandRows):
+			x1 = min(x0 + bandRows, self.size)
+			(h0, h1) = ( max(x0 - 1, 0), min(x1 + 1, self.size) )
+			band = self.rows(self.occupied, h0, h1)
+			sticky = (dilate(band) & ~band)[x0 - h0:x1 - h0]
+			self.stop[x0:x1] = np.packbits(sticky | self.rows(self.kill, x0, x1), axis = 1)
+			occupied += int( np.count_nonzero(band[x0 - h0:x1 - h0]) )
+		self.free = self.size * self.size - occupied
+
+	def trackDistance(self):
+		raise Exception("The jump engine needs the bytes lattice")
+
+	def randomFreeSite(self, rand):
+		(size, stride) = (self.size, self.stride)
+		occupied = self.occupiedBytes
+		while True:
+			x = int(rand() * size)
+			y = int(rand() * size)
+			if not occupied[x * stride + (y >> 3)] & (128 >> (y & 7)):
+				return (x, y)
+
+	#Same as Lattice.walk on the stop bits
+	def walk(self, x, y, rand):
+		(size, stride) = (self.size, self.stride)
+		stop = self.stopBytes
+		while not stop[x * stride + (y >> 3)] & (128 >> (y & 7)):
+			(dx, dy) = adjacency[ int(rand() * 8) ]
+			if 0 <= x + dx < size:
+				x += dx
+			if 0 <= y + dy < size:
+				y += dy
+		if self.killBytes[x * stride + (y >> 3)] & (128 >> (y & 7)):
+			return None
+		return (x, y)
+
+	def flag(self, x, y):
+		(index, mask) = (x * self.stride + (y >> 3), 128 >> (y & 7))
+		if self.occupiedBytes[index] & mask:
+			return OCCUPIED
+		if self.killBytes[index] & mask:
+			return KILL
+		if self.stopBytes[index] & mask:
+			return STICKY
+		return EMPTY
+
+	def stopped(self, xs, ys):
+		return ( self.stop[xs, ys >> 3] & (128 >> (ys & 7)) ) != 0
+
+	def occupiedSites(self):
+		(xs, ys) = ([], [])
+		for x0 in range(0, self.size, bandRows):
+			(x, y) = np.nonzero( self.rows(self.occupied, x0, x0 + bandRows) )
+			xs.append(x + x0)
+			ys.append(y)
+		return ( np.concatenate(xs), np.concatenate(ys) )
+
+	def occupiedBits(self):
+		return self.occupied
+
+	def markKill(self, outside):
+		for x0 in range(0, self.size, bandRows):
+			x1 = min(x0 + bandRows, self.size)
+			kill = self.rows(self.kill, x0, x1)
+			sticky = self.rows(self.stop, x0, x1) & ~kill
+			kill = outside(x0, x1) & ~sticky & ~self.rows(self.occupied, x0, x1)
+			self.kill[x0:x1] = np.packbits(kill, axis = 1)
+			self.stop[x0:x1] = np.packbits(kill | sticky, axis = 1)
+
+	def stick(self, x, y):
+		(size, stride) = (self.size, self.stride)
+		(occupied, stop) = (self.occupiedBytes, self.stopBytes)
+		self.count += 1
+		self.free -= 1
+		(index, mask) = (x * stride + (y >> 3), 128 >> (y & 7))
+		occupied[index] |= mask
+		stop[index] &= 255 ^ mask
+		self.arrival[x, y] = self.count
+		for dx, dy in adjacency:
+			(i, j) = (x + dx, y + dy)
+			if (0 <= i < size) and (0 <= j < size):
+				(index, mask) = (i * stride + (j >> 3), 128 >> (j & 7))
+				if not occupied[index] & mask:
+					stop[index] |= mask
+
+	#Write the image on a PNG file by bands of rows, flipped top to bottom
+	#like the images shown by main, so it never has to be in memory at once
+	def writeImage(self, path, colors, n_particles):
+		table = colorTable(colors)
+
+		def bands():
+			for y1 in range(self.size, 0, -bandRows):
+				y0 = max(y1 - bandRows, 0)
+				(b0, b1) = ( y0 >> 3, (y1 + 7) >> 3 )
+				occupied = np.unpackbits(self.occupied[:, b0:b1], axis = 1)[:, y0 - 8 * b0:y1 - 8 * b0]
+				arrival = np.asarray(self.arrival[:, y0:y1])
+				rgb = np.zeros((self.size, y1 - y0, 3), dtype=np.uint8)
+				rgb[occupied.astype(bool)] = 255
+				stuck = arrival > 0
+				rgb[stuck] = table[ arrival[stuck].astype(np.int64) * len(table) // n_particles ]
+				yield rgb.transpose(1, 0, 2)[::-1]
+
+		writePNG(path, self.size, self.size, bands())
+
+#Write a RGB PNG file from bands of rows given top to bottom as uint8 arrays
+#(rows, width, 3), so that the whole image never has to be in memory
+def writePNG(path, width, height, bands):
+
+	def chunk(f, kind, data):
+		f.write( struct.pack('>I', len(data)) )
+		f.write(kind + data)
+		f.write( struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff) )
+
+	with open(path, 'wb') as f:
+		f.write(b'\x89PNG\r\n\x1a\n')
+		chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+		compressor = zlib.compressobj()
+		for band in bands:
+			#Each row starts with its filter type, none
+			rows = np.zeros((len(band), 3 * width + 1), dtype=np.uint8)
+			rows[:, 1:] = band.reshape(len(band), 3 * width)
+			data = compressor.compress( rows.tobytes() )
+			if len(data) > 0:
+				chunk(f, b'IDAT', data)
+		chunk(f, b'IDAT', compressor.flush())
+		chunk(f, b'IEND', b'')
+
+#Mark the sites having an adjacent site set in a boolean mask
+def dilate(mask):
+	(width, height) = mask.shape
+	near = np.zeros_like(mask)
+	for dx, dy in adjacency:
+		near[max(0, -dx):width - max(0, dx), max(0, -dy):height - max(0, dy)] |= \
+			mask[max(0, dx):width - max(0, -dx), max(0, dy):height - max(0, -dy)]
+	return near
+
+#Launch walkers from any free site of the lattice, as normalSimulation does
+class UniformLauncher(object):
+
+	def __init__(self, lattice):
+		self.lattice = lattice
+
+	def launch(self, rand):
+		return self.lattice.randomFreeSite(rand)
+
+	def update(self, x, y):
+		pass
+
+	#Lower bound of the distance from a site to the cluster
+	def clearance(self, x, y):
+		return 0
+
+	#Number of concurrent walkers the batch engine can launch
+	def capacity(self):
+		return self.lattice.free
+
+	#State of the launcher saved on checkpoints
+	def getState(self):
+		return []
+
+	def setState(self, state):
+		pass
+
+#Launch walkers on a circle just outside the cluster grown around center.
+#Sites beyond the kill radius are flagged so walkers wandering there are
+#relaunched. The cluster radius is updated as each particle sticks
+class CircleLauncher(object):
+
+	def __init__(self, lattice, center, kill):
+		self.lattice = lattice
+		self.center = center
+		self.kill = kill
+		self.killRadius = 0.0
+
+		#Initial radius of the cluster from the sites occupied by the frame
+		(x, y) = lattice.occupiedSites()
+		if len(x) == 0:
+			raise Exception("Circle launch needs a frame to grow the cluster from")
+		self.radius = math.sqrt( np.max( (x - center[0])**2 + (y - center[1])**2 ) )
+		self.updateKill()
+
+	def launch(self, rand):
+		angle = rand() * 2.0 * math.pi
+		r = self.radius + launchMargin
+		last = self.lattice.size - 1
+		x = min( max( int( round(self.center[0] + r * math.cos(angle)) ), 0), last)
+		y = min( max( int( round(self.center[1] + r * math.sin(angle)) ), 0), last)
+		return (x, y)
+
+	def update(self, x, y):
+		r = math.sqrt( (x - self.center[0])**2 + (y - self.center[1])**2 )
+		if r > self.radius:
+			self.radius = r
+			self.updateKill()
+
+	def clearance(self, x, y):
+		return math.sqrt( (x - self.center[0])**2 + (y - self.center[1])**2 ) - self.radius
+
+	def capacity(self):
+		return max(1, int( batchDensity * math.pi * (self.kill * (self.radius + launchMargin))**2 ))
+
+	def getState(self):
+		return [self.radius, self.killRadius]
+
+	def setState(self, state):
+		(self.radius, self.killRadius) = state
+
+	#Flag as kill sites the free sites beyond kill times the launch radius,
+	#with some slack so this is only done a logarithmic number of times
+	def updateKill(self):
+		needed = self.kill * (self.radius + launchMargin)
+		if needed <= self.killRadius:
+			return
+		self.killRadius = needed * killSlack
+		self.lattice.markKill(self.outside)
+
+	#Sites of the rows x0 to x1 beyond the kill radius
+	def outside(self, x0, x1):
+		(x, y) = np.ogrid[x0:x1, 0:self.lattice.size]
+		return (x - self.center[0])**2 + (y - self.center[1])**2 > self.killRadius**2
+
+#Same as CircleLauncher for the bottom frame: walkers are launched on a
+#line just above the highest particle and killed far above it
+class LineLauncher(CircleLauncher):
+
+	def __init__(self, lattice, kill):
+		self.lattice = lattice
+		self.kill = kill
+		self.killRadius = 0.0
+		self.radius = np.max( lattice.occupiedSites()[1] )
+		self.updateKill()
+
+	def launch(self, rand):
+		y = min( int(self.radius) + launchMargin, self.lattice.size - 1)
+		return (int(rand() * self.lattice.size), y)
+
+	def update(self, x, y):
+		if y > self.radius:
+			self.radius = y
+			self.updateKill()
+
+	def clearance(self, x, y):
+		return y - self.radius
+
+	def capacity(self):
+		return max(1, int( batchDensity * self.lattice.size * self.kill * (self.radius + launchMargin) ))
+
+	def outside(self, x0, x1):
+		y = np.arange(self.lattice.size)
+		return np.broadcast_to(y > self.killRadius, (x1 - x0, self.lattice.size))
+
+#Create the launcher for a launch mode and frame shape
+def getLauncher(lattice, launch, frame, kill):
+	if launch == 'uniform':
+		return UniformLauncher(lattice)
+	elif launch == 'circle':
+		if frame == 'bottom':
+			return LineLauncher(lattice, kill)
+		elif frame == 'origin':
+			return CircleLauncher(lattice, (lattice.size/2, lattice.size/2), kill)
+		else:
+			raise Exception("Circle launch needs a frame growing outwards [bottom|origin]")
+	else:
+		raise Exception("Launch parameter [uniform|circle]")
+
+#Lookup table (nColors, 3) of uint8 with the RGB values of a list of colors
+def colorTable(colors):
+	return np.array([ [ int(j*255) for j in color.rgb ] for color in colors ], dtype=np.uint8)
+
+#Running metrics of a cluster, updated as each particle sticks so no
+#statistic needs to scan the lattice: count, sums of the coordinates and
+#of the squared radius, which give the radius of gyration in O(1), and a
+#mass-radius histogram of the distance to center with log bins, which gives
+#the fractal dimension. Without center, for clusters not grown from a seed,
+#there is no histogram. Every interval particles a record is written on
+#stream, as a csv row or a json line with the histogram
+class ClusterMetrics(object):
+
+	def __init__(self, center, stream = None, interval = 1000, jsonl = False):
+		self.radial = center is not None
+		self.center = center if self.radial else (0, 0)
+		self.stream = stream
+		self.interval = interval
+		self.jsonl = jsonl
+		self.count = 0
+		self.sumX = 0.0
+		self.sumY = 0.0
+		self.sumR2 = 0.0
+		self.maxRadius = 0.0
+		self.histogram = []
+
+	def add(self, x, y):
+		(dx, dy) = (x - self.center[0], y - self.center[1])
+		r2 = dx * dx + dy * dy
+		self.count += 1
+		self.sumX += dx
+		self.sumY += dy
+		self.sumR2 += r2
+
+		#Bin k holds radii in [2^(k / binsPerOctave), 2^((k + 1) / binsPerOctave))
+		if self.radial:
+			r = math.sqrt(r2)
+			self.maxRadius = max(self.maxRadius, r)
+			k = int( math.log(r, 2) * binsPerOctave ) if r >= 1.0 else 0
+			if k >= len(self.histogram):
+				self.histogram.extend( [0] * (k + 1 - len(self.histogram)) )
+			self.histogram[k] += 1
+
+		if self.stream is not None and self.count % self.interval == 0:
+			self.emit()
+
+	#Add the particles of a lattice in arrival order, without records
+	def replay(self, lattice):
+		(x, y) = np.nonzero(lattice.arrival)
+		stream = self.stream
+		self.stream = None
+		for k in np.argsort(lattice.arrival[x, y]):
+			self.add(int(x[k]), int(y[k]))
+		self.stream = stream
+
+	def gyration(self):
+		if self.count == 0:
+			return 0.0
+		(mx, my) = (self.sumX / self.count, self.sumY / self.count)
+		return math.sqrt( max(self.sumR2 / self.count - mx * mx - my * my, 0.0) )
+
+	#Slope of the mass-radius relation M(r) ~ r^D between dimensionRadius
+	#and half the radius of the cluster, or None if the cluster is too small
+	def dimension(self):
+		radii = 2.0 ** ( np.arange(1, len(self.histogram) + 1) / float(binsPerOctave) )
+		mass = np.cumsum(self.histogram)
+		fit = (radii >= dimensionRadius) & (radii <= self.maxRadius / 2.0) & (mass > 0)
+		if np.count_nonzero(fit) < 2:
+			return None
+		return float( np.polyfit( np.log(radii[fit]), np.log(mass[fit]), 1 )[0] )
+
+	def record(self):
+		return { 'particles' : self.count, 'radius_of_gyration' : self.gyration(),
+			'max_radius' : self.maxRadius if self.radial else None, 'fractal_dimension' : self.dimension() }
+
+	def emit(self):
+		record = self.record()
+		if self.jsonl:
+			record['histogram'] = self.histogram
+			self.stream.write( json.dumps(record) + '\n' )
+		else:
+			keys = ('particles', 'radius_of_gyration', 'max_radius', 'fractal_dimension')
+			if self.stream.tell() == 0:
+				self.stream.write( ','.join(keys) + '\n' )
+			self.stream.write( ','.join( '' if record[key] is None else str(record[key]) for key in keys ) + '\n' )
+		self.stream.flush()
+
+#Snapshots of the growing cluster, taken every interval particles. The RGB
+#image is kept as a numpy array of rows, flipped top to bottom like the
+#images shown by main, and painted incrementally as each particle sticks
+#with the color of its arrival order, so taking a snapshot is a plain write
+#of the buffer: a numbered PNG on directory, or a raw RGB frame on stream
+#for an external video encoder. image is the initial state of the growth,
+#where count particles already stuck
+class Snapshots(object):
+
+	def __init__(self, image, colors, n_particles, interval, directory = None, stream = None, count = 0):
+		self.rgb = np.array( image.convert('RGB') )[::-1].copy()
+		self.table = colorTable(colors)
+		self.n_particles = n_particles
+		self.interval = interval
+		self.directory = directory
+		self.stream = stream
+		self.count = count
+		self.frames = 0
+		if directory is not None and not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def add(self, x, y):
+		self.count += 1
+		(height, width) = self.rgb.shape[:2]
+		(x, y) = ( int( round(x) ), int( round(y) ) )
+		if 0 <= x < width and 0 <= y < height:
+			self.rgb[height - 1 - y, x] = self.table[ self.count * len(self.table) // self.n_particles ]
+		if self.count % self.interval == 0:
+			self.emit()
+
+	def emit(self):
+		(height, width) = self.rgb.shape[:2]
+		if self.directory is not None:
+			writePNG( os.path.join(self.directory, 'snapshot_%06d.png' % self.frames), width, height, [self.rgb] )
+		if self.stream is not None:
+			self.stream.write( self.rgb.tobytes() )
+			self.stream.flush()
+		self.frames += 1
+
+#Forward each particle stuck to several recorders, like the cluster metrics
+#and the snapshots. Return None without recorders, or the only one given
+class Recorders(object):
+
+	def __init__(self, recorders):
+		self.recorders = recorders
+
+	def add(self, x, y):
+		for recorder in self.recorders:
+			recorder.add(x, y)
+
+def recorders(*recorders):
+	recorders = [ recorder for recorder in recorders if recorder is not None ]
+	if len(recorders) == 0:
+		return None
+	elif len(recorders) == 1:
+		return recorders[0]
+	return Recorders(recorders)
+
+#Progress bar of the lattice simulations, hidden when quiet
+def getProgressBar(quiet = False):
+	fd = open(os.devnull, 'w') if quiet else sys.stderr
+	return ProgressBar(maxval=steps, widgets=[Bar('=', '[', ']'), ' ', Percentage()], fd=fd)
+
+#Simulation of DLA on the occupancy lattice. Same process as normalSimulation
+#but neighbourhood checks are a single lookup on the precomputed sticky sites
+#The launcher decides where walkers start, by default any free site
+#With jump, walkers far from the aggregate move in jumps instead of single steps
+#Simulation resumes after the particles already in the lattice, and a
+#checkpoint and the cluster metrics are updated after each particle if given
+def gridSimulation(lattice, n_particles, rng = random, launcher = None, jump = False, quiet = False, checkpoint = None, metrics = None):
+
+	rand = rng.random
+	if launcher is None:
+		launcher = UniformLauncher(lattice)
+	if jump:
+		if lattice.distance is None:
+			lattice.trackDistance()
+		walk = lambda x, y, rand: lattice.jumpWalk(x, y, rand, launcher)
+	else:
+		walk = lattice.walk
+
+	#Set up a progress bar to show calculations
+	bar = getProgressBar(quiet)
+	bar.start()
+
+	#Iterate over all n particles
+	for i in range(lattice.count + 1, n_particles):
+
+		#Stop if there is no room left for new particles
+		if lattice.free == 0:
+			break
+
+		#Launch a walker until it sticks instead of reaching a kill site
+		position = None
+		while position is None:
+			(x, y) = launcher.launch(rand)
+			position = walk(x, y, rand)
+		lattice.stick(*position)
+		launcher.update(*position)
+		if metrics is not None:
+			metrics.add(*position)
+
+		#Save the state of the simulation
+		if checkpoint is not None:
+			checkpoint.update(lattice, launcher, rng)
+
+		#Update progress bar
+		if i % (n_particles / steps) == 0:
+			bar.update( int( float(i) / n_particles * steps) )
+
+	#Close the progress bar
+	bar.finish()
+
+#Simulation of DLA with a batch of concurrent walkers stored as numpy arrays
+#and moved together with one vectorized draw per step. Walkers reaching a
+#sticky site are resolved in walker order, so the result only depends on rng
+#The batch grows up to walkers as the launcher capacity allows
+def batchSimulation(lattice, n_particles, rng = random, launcher = None, walkers = 1000, quiet = False, metrics = None):
+
+	rand = rng.random
+	if launcher is None:
+		launcher = UniformLauncher(lattice)
+
+	#Random generator for the moves, seeded from rng
+	moves = np.random.RandomState( rng.getrandbits(32) )
+	(mx, my) = np.array(adjacency).T
+	size = lattice.size
+
+	#Positions of the walkers
+	walkers = min(walkers, n_particles - 1)
+	xs = np.zeros(0, dtype=np.int64)
+	ys = np.zeros(0, dtype=np.int64)
+
+	#Set up a progress bar to show calculations
+	bar = getProgressBar(quiet)
+	bar.start()
+
+	i = 1
+	while i < n_particles and lattice.free > 0:
+
+		#Launch new walkers while there is room around the cluster
+		room = min(walkers, launcher.capacity()) - len(xs)
+		if room > 0:
+			(x, y) = np.array([ launcher.launch(rand) for k in range(0, room) ], dtype=np.int64).T
+			xs = np.concatenate( (xs, x) )
+			ys = np.concatenate( (ys, y) )
+
+		#Resolve walkers on sticky or kill sites. Flags may have changed
+		#since the gather, by particles stuck earlier in this same step: a
+		#walker on a site just occupied is relaunched, or it would walk
+		#through the cluster since stopped() treats occupied sites as free.
+		#Walkers are relaunched once the step is resolved, so none lands on
+		#a sticky site occupied later in the step
+		relaunch = []
+		for k in np.nonzero( lattice.stopped(xs, ys) )[0]:
+			(x, y) = (int(xs[k]), int(ys[k]))
+			flag = lattice.flag(x, y)
+			if flag != EMPTY:
+				relaunch.append(k)
+			if flag == STICKY:
+				lattice.stick(x, y)
+				launcher.update(x, y)
+				if metrics is not None:
+					metrics.add(x, y)
+
+				#Update progress bar
+				if i % (n_particles / steps) == 0:
+					bar.update( int( float(i) / n_particles * steps) )
+
+				i += 1
+				if i == n_particles or lattice.free == 0:
+					break
+		for k in relaunch:
+			(xs[k], ys[k]) = launcher.launch(rand)
+
+		#Move all the walkers. Do not bounce on image limits, like moveParticle
+		#Walkers relaunched or next to a particle stuck in this step may be on
+		#sticky sites, they hold still to be resolved by the next gather
+		draw = moves.randint(0, 8, len(xs))
+		x = xs + mx[draw]
+		y = ys + my[draw]
+		if relaunch:
+			held = lattice.stopped(xs, ys)
+			(x, y) = ( np.where(held, xs, x), np.where(held, ys, y) )
+		xs = np.where( (0 <= x) & (x < size), x, xs )
+		ys = np.where( (0 <= y) & (y < size), y, ys )
+
+	#Close the progress bar
+	bar.finish()
+
+#Number of particles to simulate according to the command line arguments
+def getParticles(args):
+	if args['p'] is None:
+		return args['n']
+	return int(args['s']**2 * args['p'])
+
+#Create a lattice with the frame given by the command line arguments
+#and its launcher
+def createLattice(args):
+	image_size = args['s']
+	frame_shape = args['f']
+
+	#Create the lattice and paint the initial frame where particles can stick
+	if args['lattice'] == 'bits':
+		lattice = PackedLattice(image_size, getParticles(args), args['memmap'])
+	elif args['lattice'] == 'bytes':
+		lattice = Lattice(image_size)
+	else:
+		raise Exception("Lattice parameter [bytes|bits]")
+	paintFrame(lattice.pixels, image_size, frame_shape, OCCUPIED)
+	lattice.updateSticky()
+
+	launcher = getLauncher(lattice, args['l'], frame_shape, args['k'])
+	return (lattice, launcher)
+
+#Simulate the DLA on a lattice with the engine given by the command line arguments
+def runLattice(args, lattice, launcher, n_particles, rng = random, quiet = False, checkpoint = None, metrics = None):
+	if args['e'] == 'batch':
+		if checkpoint is not None:
+			raise Exception("Checkpoints are only supported by the [grid|jump] engines")
+		batchSimulation(lattice, n_particles, rng, launcher, args['w'], quiet, metrics)
+	elif args['e'] in ('grid', 'jump'):
+		gridSimulation(lattice, n_particles, rng, launcher, args['e'] == 'jump', quiet, checkpoint, metrics)
+	else:
+		raise Exception("Lattice engine parameter [grid|jump|batch]")
+
+#Create a lattice and simulate the DLA on it with one of the lattice engines
+def latticeSimulation(args, n_particles, rng = random, quiet = False, checkpoint = None, metrics = None):
+	(lattice, launcher) = createLattice(args)
+	runLattice(args, lattice, launcher, n_particles, rng, quiet, checkpoint, metrics)
+	return lattice
+
+#Center of the cluster metrics: the seed of the origin frame, none for the
+#other frames, where the mass-radius relation is meaningless
+def metricsCenter(args):
+	if args['f'] == 'origin':
+		return (args['s']/2, args['s']/2)
+	return None
+
+#Periodic checkpoints of a lattice simulation: lattice flags and arrival
+#order, particle count, launcher and random generator state. The file is
+#written aside and renamed, so a crash never leaves a broken checkpoint
+class Checkpoint(object):
+
+	def __init__(self, path, interval, args, n_particles):
+		self.path = path
+		self.interval = interval
+		self.args = args
+		self.n_particles = n_particles
+
+	#Save the simulation every interval particles
+	def update(self, lattice, launcher, rng):
+		if lattice.count % self.interval == 0:
+			self.save(lattice, launcher, rng)
+
+	def save(self, lattice, launcher, rng):
+		(version, state, gauss) = rng.getstate()
+		arrays = { 'flags' : lattice.flags, 'arrival' : lattice.arrival,
+			'count' : lattice.count, 'free' : lattice.free, 'n_particles' : self.n_particles,
+			'args' : json.dumps(self.args), 'launcher' : launcher.getState(),
+			'rng_version' : version, 'rng_state' : np.array(state, dtype=np.uint32),
+			'rng_gauss' : [] if gauss is None else [gauss] }
+		if lattice.distance is not None:
+			arrays['distance'] = lattice.distance
+
+		temporary = self.path + '.tmp'
+		with open(temporary, 'wb') as f:
+			np.savez(f, **arrays)
+		os.rename(temporary, self.path)
+
+#Restore a simulation from a checkpoint file
+#Return the arguments and number of particles of the simulation, and
+#its lattice, launcher and random generator
+def loadCheckpoint(path):
+	data = np.load(path)
+	args = json.loads( str(data['args']) )
+	(lattice, launcher) = createLattice(args)
+
+	#Launchers mark kill sites on creation, so flags are restored afterwards
+	launcher.setState( list(data['launcher']) )
+	lattice.flags[...] = data['flags']
+	lattice.arrival[...] = data['arrival']
+	lattice.count = int(data['count'])
+	lattice.free = int(data['free'])
+	if 'distance' in data:
+		lattice.trackDistance()
+		lattice.distance[...] = data['distance']
+
+	rng = random.Random()
+	gauss = list(data['rng_gauss'])
+	rng.setstate( ( int(data['rng_version']), tuple( int(j) for j in data['rng_state'] ),
+		gauss[0] if len(gauss) > 0 else None ) )
+
+	return (args, int(data['n_particles']), lattice, launcher, rng)
+
+#Seed of the independent random stream number index derived from a master
+#seed, the same whatever the number of processes running the streams
+def streamSeed(seed, index):
+	return int( hashlib.sha256( '%d:%d' % (seed, index) ).hexdigest(), 16 )
+
+#Simulate the cluster number index of an ensemble and save its occupied sites
+#and arrival order on the output directory. Return the metrics of the cluster
+def simulateCluster(args, index):
+	seed = streamSeed(args['r'], index)
+	metrics = ClusterMetrics( metricsCenter(args) )
+	start = time.time()
+	lattice = latticeSimulation(args, getParticles(args), random.Random(seed), True, None, metrics)
+	elapsed = time.time() - start
+
+	np.savez_compressed( os.path.join(args['d'], 'cluster_%04d.npz' % index),
+		occupied = lattice.occupiedBits(), arrival = lattice.arrival )
+
+	return { 'run' : index, 'seed' : seed, 'particles' : lattice.count, 'seconds' : elapsed,
+		'radius_of_gyration' : metrics.gyration(), 'fractal_dimension' : metrics.dimension() }
+
+#Simulate an ensemble of N clusters with independent random streams on a
+#pool of processes, and merge the metrics of every cluster on a summary file
+def ensemble(args):
+	if args['r'] is None:
+		args['r'] = 0
+	if not os.path.isdir(args['d']):
+		os.makedirs(args['d'])
+
+	runs = args['N']
+	pool = multiprocessing.Pool(args['j'])
+	try:
+		results = [ pool.apply_async(simulateCluster, (args, index)) for index in range(0, runs) ]
+		metrics = [ result.get() for result in results ]
+	finally:
+		pool.terminate()
+		pool.join()
+
+	summary = { 'args' : args, 'runs' : metrics }
+	for key in ('radius_of_gyration', 'fractal_dimension'):
+		values = [ m[key] for m in metrics if m[key] is not None ]
+		if len(values) > 0:
+			summary[key] = { 'mean' : float(np.mean(values)), 'std' : float(np.std(values)) }
+
+	with open( os.path.join(args['d'], 'summary.json'), 'w' ) as f:
+		json.dump(summary, f, indent = 1)
+	return summary
 	
 def main():
 	#Parse command line arguments
@@ -137,38 +1096,141 @@ def main():
 	#parser.print_help()
 	args = vars( parser.parse_args() )
 
-	image_size = args['s']
-	if args['p'] is None:
-		n_particles = args['n']
+	#Raw frames take stdout, so messages go to stderr
+	frames = None
+	if args['snapshots'] == '-':
+		frames = sys.stdout
+		sys.stdout = sys.stderr
+
+	#Continue a simulation from its checkpoint, with its same parameters
+	if args['resume'] is not None:
+		(saved, n_particles, lattice, launcher, rng) = loadCheckpoint(args['resume'])
+		for key in simulationArgs:
+			args[key] = saved[key]
+		if args['checkpoint'] is None:
+			args['checkpoint'] = args['resume']
+		print "Resuming simulation after ", lattice.count, " particles"
 	else:
-		n_particles = int(image_size**2 * args['p'])
+		n_particles = getParticles(args)
+
+	image_size = args['s']
 	
 	frame_shape = args['f']	
 	output_file = args['o'] 
+	engine = args['e']
+	launch = args['l']
 		
 	#Description of the simulation
 	print "Starting simulation for a ", image_size, "x", image_size, " image"
 	print "Number of particles: ", n_particles
 	print "Frame shape: ", frame_shape
-	
-	#Create the bitmap containing the DLA result
-	img = Image.new( 'RGB', (image_size, image_size), "black")
-	pixels = img.load()
+	print "Engine: ", engine, " Launch: ", launch
+
+	#Run an ensemble of clusters instead of a single image
+	if args['N'] is not None:
+		print "Ensemble of ", args['N'], " clusters on ", args['d']
+		summary = ensemble(args)
+		for key in ('radius_of_gyration', 'fractal_dimension'):
+			if key in summary:
+				print key, ": ", summary[key]['mean'], " +- ", summary[key]['std']
+		return
 	
 	#Create range of colors
 	red = colour.Color("red")
 	blue = colour.Color("blue")	
 	rangeColor = list( red.range_to(blue, nColors) )
+
+	#Stream the metrics of the cluster while simulating. A resumed
+	#simulation appends to the stream after replaying its particles
+	metrics = None
+	if args['metrics'] is not None:
+		stream = open(args['metrics'], 'w' if args['resume'] is None else 'a')
+		metrics = ClusterMetrics(metricsCenter(args), stream, args['metrics_every'], args['metrics'].endswith('.jsonl'))
+		if args['resume'] is not None:
+			metrics.replay(lattice)
+
+	#Snapshots of the growth, starting from the image of the initial state
+	def getSnapshots(image, count = 0):
+		if args['snapshots'] is None:
+			return None
+		directory = None if frames is not None else args['snapshots']
+		return Snapshots(image, rangeColor, n_particles, args['snapshot_every'], directory, frames, count)
+	snapshots = None
 	
-	#Paint the initial frame where particles can stick
-	paintFrame(pixels, image_size, frame_shape)
+	if engine == 'image':
+		#Create the bitmap containing the DLA result
+		img = Image.new( 'RGB', (image_size, image_size), "black")
+		pixels = img.load()
 	
-	#Simulate the DLA
-	normalSimulation(pixels, n_particles, image_size, rangeColor)
+		#Paint the initial frame where particles can stick
+		paintFrame(pixels, image_size, frame_shape)
+	
+		#Simulate the DLA
+		snapshots = getSnapshots(img)
+		rng = random if args['r'] is None else random.Random(args['r'])
+		normalSimulation(pixels, n_particles, image_size, rangeColor, recorders(metrics, snapshots), rng)
+	
+	elif engine in ('grid', 'jump', 'batch'):
+		#Create the lattice, unless it was restored from a checkpoint
+		if args['resume'] is None:
+			rng = random if args['r'] is None else random.Random(args['r'])
+			(lattice, launcher) = createLattice(args)
+
+		checkpoint = None
+		if args['checkpoint'] is not None:
+			if args['lattice'] != 'bytes':
+				raise Exception("Checkpoints need the bytes lattice")
+			checkpoint = Checkpoint(args['checkpoint'], args['checkpoint_every'], args, n_particles)
+
+		#Simulate the DLA. The bits lattice has no image method, its
+		#snapshots start from an image of the frame
+		if args['snapshots'] is not None:
+			if args['lattice'] == 'bits':
+				start = Image.new( 'RGB', (image_size, image_size), "black")
+				paintFrame(start.load(), image_size, frame_shape)
+			else:
+				start = lattice.image(rangeColor, n_particles)
+			snapshots = getSnapshots(start, lattice.count)
+		runLattice(args, lattice, launcher, n_particles, rng, False, checkpoint, recorders(metrics, snapshots))
+
+		#The bits lattice writes its image by bands instead of showing it
+		if args['lattice'] == 'bits':
+			if metrics is not None and metrics.count % metrics.interval != 0:
+				metrics.emit()
+			if snapshots is not None and snapshots.count % snapshots.interval != 0:
+				snapshots.emit()
+			if output_file is None:
+				raise Exception("The bits lattice needs an output file")
+			lattice.writeImage(output_file, rangeColor, n_particles)
+			return
+
+		#Build the bitmap containing the result
+		img = lattice.image(rangeColor, n_particles)
+	
+	elif engine == 'offlattice':
+		#Off-lattice particles, always launched on a circle around the cluster
+		import offlattice
+		rng = random if args['r'] is None else random.Random(args['r'])
+		cluster = offlattice.OffLatticeCluster(image_size, frame_shape, args['k'], args['step'])
+		snapshots = getSnapshots( cluster.image(rangeColor, n_particles) )
+		offlattice.offLatticeSimulation(cluster, n_particles, rng, False, recorders(metrics, snapshots))
+		img = cluster.image(rangeColor, n_particles)
+
+	else:
+		raise Exception("Engine parameter [grid|jump|batch|offlattice|image]")
+
+	#Last record of the metrics, for the final cluster
+	if metrics is not None and metrics.count % metrics.interval != 0:
+		metrics.emit()
+
+	#Last snapshot, for the final cluster
+	if snapshots is not None and snapshots.count % snapshots.interval != 0:
+		snapshots.emit()
 				
-	#Show the result
+	#Show the result, unless headless or taking snapshots
 	img = img.transpose(Image.FLIP_TOP_BOTTOM)
-	img.show()
+	if not args['headless'] and args['snapshots'] is None:
+		img.show()
 	
 	#Save the image if we specified an output file	
 	if output_file is not None:
@@ -0,0 +1,193 @@
+import Image
+import math
+import random
+import numpy as np
+from diffusionlimitedaggregation import colorTable, getProgressBar, launchMargin, steps
+
+#Off-lattice DLA: particles are discs of diameter 1 with real valued
+#positions, moving in steps of random direction. Walkers are launched on a
+#circle just outside the cluster (a line above it for the bottom frame) and
+#relaunched beyond the kill radius, like CircleLauncher does on the lattice.
+#Contacts are found with a spatial hash of cells holding the particles, so
+#each step only checks the particles of the 3x3 cells around the walker
+
+#Distance between the centers of two touching particles
+diameter = 1.0
+
+#Cluster of particles growing from a seed particle on the center of the
+#image (origin frame) or from the bottom line of the image (bottom frame)
+class OffLatticeCluster(object):
+
+	def __init__(self, size, frame, kill, step = 1.0):
+		self.size = size
+		self.frame = frame
+		self.kill = kill
+		self.step = step
+		self.count = 0
+
+		#Particles within diameter of a step start at most diameter + step
+		#away, so they lie in the 3x3 cells around the walker
+		self.cell = diameter + step
+		self.cells = {}
+		self.xs = []
+		self.ys = []
+
+		if frame == 'origin':
+			self.center = (size / 2.0, size / 2.0)
+			self.add(self.center[0], self.center[1])
+			self.radius = 0.0
+		elif frame == 'bottom':
+			#Height of the highest particle center, the bottom line behaves as
+			#a row of particles centered half a diameter below it
+			self.radius = -diameter / 2.0
+		else:
+			raise Exception("Off-lattice frame parameter [bottom|origin]")
+		self.seeds = len(self.xs)
+
+	def add(self, x, y):
+		key = ( int(x // self.cell), int(y // self.cell) )
+		self.cells.setdefault(key, []).append( len(self.xs) )
+		self.xs.append(x)
+		self.ys.append(y)
+
+	#Stick a new particle and update the radius of the cluster
+	def stick(self, x, y):
+		self.add(x, y)
+		self.count += 1
+		if self.frame == 'origin':
+			self.radius = max(self.radius, math.hypot(x - self.center[0], y - self.center[1]))
+		else:
+			self.radius = max(self.radius, y)
+
+	#Distance from a position to the cluster radius, and whether the walker
+	#wandered beyond the kill radius
+	def clearance(self, x, y):
+		if self.frame == 'origin':
+			d = math.hypot(x - self.center[0], y - self.center[1])
+		else:
+			d = y
+		return ( d - self.radius - diameter, d > self.kill * (self.radius + launchMargin) )
+
+	def launch(self, rand):
+		r = self.radius + launchMargin
+		if self.frame == 'origin':
+			angle = rand() * 2.0 * math.pi
+			return ( self.center[0] + r * math.cos(angle), self.center[1] + r * math.sin(angle) )
+		return ( rand() * self.size, r )
+
+	#Smallest advance t <= length along the direction (ux, uy) where the
+	#walker touches a particle or the bottom line, None if there is no contact
+	def contact(self, x, y, ux, uy, length):
+		best = None
+		(i, j) = ( int(x // self.cell), int(y // self.cell) )
+		(xs, ys) = (self.xs, self.ys)
+		for di in (-1, 0, 1):
+			for dj in (-1, 0, 1):
+				for k in self.cells.get( (i + di, j + dj), () ):
+					#Solve |p - q + t u| = diameter for the first t
+					(px, py) = (x - xs[k], y - ys[k])
+					b = ux * px + uy * py
+					c = px * px + py * py - diameter * diameter
+					if b >= 0 or b * b < c:
+						continue
+					t = max( -b - math.sqrt(b * b - c), 0.0 )
+					if t <= length and (best is None or t < best):
+						best = t
+
+		if self.frame == 'bottom' and uy < 0:
+			t = max( (y - diameter / 2.0) / -uy, 0.0 )
+			if t <= length and (best is None or t < best):
+				best = t
+		return best
+
+	#Move a walker in steps of random direction until touching the cluster
+	#Far from the cluster, it jumps to the clearance in a single step, which
+	#is where a brownian motion first leaves the disc of that radius
+	#Return None if the walker wandered beyond the kill radius
+	def walk(self, x, y, rand):
+		(cos, sin, turn) = (math.cos, math.sin, 2.0 * math.pi)
+		while True:
+			(clearance, killed) = self.clearance(x, y)
+			if killed:
+				return None
+
+			angle = rand() * turn
+			(ux, uy) = (cos(angle), sin(angle))
+			if clearance > self.step:
+				#The clearance only depends on y for the bottom frame, so a
+				#jump reflected on the sides never reaches the cluster either.
+				#A jump can be longer than the strip and bounce several times,
+				#so x is folded back into [0, size]
+				(x, y) = (x + clearance * ux, y + clearance * uy)
+				if self.frame == 'bottom':
+					x = x % (2 * self.size)
+					if x > self.size:
+						x = 2 * self.size - x
+				continue
+
+			#Steps of the bottom frame bounce on the sides of the image, and
+			#each part of the step before and after a bounce is tested
+			length = self.step
+			while length > 0:
+				part = length
+				if self.frame == 'bottom':
+					if ux < 0 and x + part * ux < 0:
+						part = -x / ux
+					elif ux > 0 and x + part * ux > self.size:
+						part = (self.size - x) / ux
+				t = self.contact(x, y, ux, uy, part)
+				if t is not None:
+					return (x + t * ux, y + t * uy)
+				(x, y) = (x + part * ux, y + part * uy)
+				length -= part
+				ux = -ux
+
+	#Build the RGB image with the same color gradient as the lattice,
+	#frame in white and particles colored by arrival order
+	def image(self, colors, n_particles):
+		table = colorTable(colors)
+		rgb = np.zeros((self.size, self.size, 3), dtype=np.uint8)
+		if self.frame == 'bottom':
+			rgb[:, 0] = 255
+
+		x = np.rint(self.xs).astype(np.int64)
+		y = np.rint(self.ys).astype(np.int64)
+		arrival = np.arange(len(x)) - self.seeds + 1
+		inside = (0 <= x) & (x < self.size) & (0 <= y) & (y < self.size)
+		(x, y, arrival) = (x[inside], y[inside], arrival[inside])
+
+		seed = arrival <= 0
+		rgb[x[seed], y[seed]] = 255
+		rgb[x[~seed], y[~seed]] = table[ arrival[~seed] * len(table) // n_particles ]
+
+		#Numpy arrays are indexed [row, column], that is, [y, x]
+		return Image.fromarray(rgb.transpose(1, 0, 2))
+
+#Simulation of off-lattice DLA, one walker at a time. The cluster metrics
+#are updated after each particle if given
+def offLatticeSimulation(cluster, n_particles, rng = random, quiet = False, metrics = None):
+
+	rand = rng.random
+
+	#Set up a progress bar to show calculations
+	bar = getProgressBar(quiet)
+	bar.start()
+
+	#Iterate over all n particles
+	for i in range(cluster.count + 1, n_particles):
+
+		#Launch a walker until it sticks instead of wandering away
+		position = None
+		while position is None:
+			(x, y) = cluster.launch(rand)
+			position = cluster.walk(x, y, rand)
+		cluster.stick(*position)
+		if metrics is not None:
+			metrics.add(*position)
+
+		#Update progress bar
+		if i % (n_particles / steps) == 0:
+			bar.update( int( float(i) / n_particles * steps) )
+
+	#Close the progress bar
+	bar.finish()
@@ -0,0 +1,67 @@
+import random
+import unittest
+import numpy as np
+import diffusionlimitedaggregation as dla
+import offlattice
+
+#Seeded checks of the DLA engines, run from this directory with
+#python -m unittest test_diffusionlimitedaggregation
+
+#Mean fractal dimension of a few seeded origin clusters grown by an engine
+def meanDimension(engine, size = 201, n_particles = 1500, seeds = 4):
+	args = vars( dla.getCommandLineParser().parse_args([]) )
+	args.update( { 's' : size, 'f' : 'origin', 'l' : 'circle', 'e' : engine } )
+	dimensions = []
+	for seed in range(0, seeds):
+		metrics = dla.ClusterMetrics( dla.metricsCenter(args) )
+		dla.latticeSimulation(args, n_particles, random.Random(seed), True, None, metrics)
+		dimensions.append( metrics.dimension() )
+	return sum(dimensions) / len(dimensions)
+
+class JumpWalkTest(unittest.TestCase):
+
+	#Jumps only shortcut the walk far from the cluster, so the clusters have
+	#the same fractal dimension as step by step walks. A single cluster of
+	#1500 particles spreads about 0.1 around D ~ 1.7-1.9, the mean of four
+	#differs by less than 0.15
+	def testDimensionMatchesGrid(self):
+		grid = meanDimension('grid')
+		jump = meanDimension('jump')
+		self.assertTrue(1.6 < grid < 2.0, grid)
+		self.assertTrue(1.6 < jump < 2.0, jump)
+		self.assertLess( abs(jump - grid), 0.15 )
+
+class BatchTest(unittest.TestCase):
+
+	#Walkers reaching the same sticky site in one step stick once, the other
+	#ones are relaunched instead of walking on through the occupied sites
+	def testNoWalkerOnOccupiedSites(self):
+		args = vars( dla.getCommandLineParser().parse_args([]) )
+		args.update( { 's' : 200, 'f' : 'bottom', 'e' : 'batch', 'w' : 1000 } )
+		(lattice, launcher) = dla.createLattice(args)
+		occupied = []
+		stopped = lattice.stopped
+		def check(xs, ys):
+			occupied.append( int( (lattice.flags[xs, ys] == dla.OCCUPIED).sum() ) )
+			return stopped(xs, ys)
+		lattice.stopped = check
+		dla.runLattice(args, lattice, launcher, 4000, random.Random(0), True)
+		self.assertEqual( sum(occupied), 0 )
+
+class OffLatticeTest(unittest.TestCase):
+
+	#Jumps on a strip narrower than the clearance bounce on both sides many
+	#times, and particles stuck near the sides are still never overlapped
+	def testNarrowStripNoOverlap(self):
+		for seed in range(0, 6):
+			cluster = offlattice.OffLatticeCluster(12, 'bottom', 3.0)
+			offlattice.offLatticeSimulation(cluster, 800, random.Random(seed), True)
+			(x, y) = ( np.array(cluster.xs), np.array(cluster.ys) )
+			self.assertTrue( ((0 <= x) & (x <= cluster.size)).all(), seed )
+			distance = np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+			np.fill_diagonal(distance, np.inf)
+			self.assertGreaterEqual( distance.min(), offlattice.diameter - 1e-9, seed )
+
+
+if __name__ == "__main__":
+  unittest.main()
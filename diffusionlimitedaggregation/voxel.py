@@ -0,0 +1,322 @@
+import os
+import math
+import random
+import argparse
+import colour
+import numpy as np
+from array import array
+from diffusionlimitedaggregation import EMPTY, OCCUPIED, STICKY, KILL, nColors, steps, launchMargin, \
+	writePNG, colorTable, getProgressBar, UniformLauncher, CircleLauncher, LineLauncher
+
+#3D DLA on a voxel volume, for porosity studies. The volume keeps one byte
+#of flags per voxel, like Lattice, so a 512^3 volume takes 128 MB. The
+#arrival order is kept as the list of coordinates of the particles, as
+#16 bit integers, instead of a per voxel array
+
+#the adjacency tables for movements and neighbourhood check, with the 26
+#voxels around a voxel or only the 6 sharing a face with it
+adjacency26 = [(i,j,k) for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1) if not (i == j == k == 0)]
+adjacency6 = [(i,j,k) for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1) if abs(i) + abs(j) + abs(k) == 1]
+
+#Radius of the seed ball of the origin frame
+originRadius = 5
+
+#Number of x slabs processed at once on the volume
+slabSize = 16
+
+#Create parser for command line arguments
+def getCommandLineParser():
+	parser = argparse.ArgumentParser(description='Grow a 3D brownian tree using Diffusion Limited Aggregation on a voxel volume.')
+	parser.add_argument('-s', default='128', help='Create a volume of size x size x size voxels', type=int)
+	parser.add_argument('-n', default='10000', help='Number of particles to simulate', type=int)
+	parser.add_argument('-p', help='Fraction of particles of the total number of voxels on the volume', type=float, required=False)
+	parser.add_argument('-f', default='origin', help='Frame shape where particles can stick: [bottom|origin]', type=str, required=False)
+	parser.add_argument('-a', default='26', help='Adjacency of the voxels: [6|26]', type=int, required=False)
+	parser.add_argument('-l', default='circle', help='Where walkers are launched: [uniform|circle]. circle launches on a sphere just outside the cluster (a plane above it for the bottom frame)', type=str, required=False)
+	parser.add_argument('-k', default='2.0', help='Kill radius of the circle launch, as a factor of the launch radius', type=float, required=False)
+	parser.add_argument('-r', help='Seed of the random generator', type=int, required=False)
+	parser.add_argument('-o', help='File name to save the point cloud (.xyz text or .npy)', type=str, required=False)
+	parser.add_argument('--slices', help='Directory to save one PNG image per z slice', type=str, required=False)
+	return parser
+
+#Voxel volume of the simulation, indexed as volume[x, y, z]. Flags live in
+#a flat bytearray (index (x * size + y) * size + z) with a numpy view, like Lattice
+class Volume(object):
+
+	def __init__(self, size, adjacency):
+		self.size = size
+		self.adjacency = adjacency
+		self.sites = bytearray(size**3)
+		self.flags = np.frombuffer(self.sites, dtype=np.uint8).reshape(size, size, size)
+		self.xs = array('H')
+		self.ys = array('H')
+		self.zs = array('H')
+		self.count = 0
+		self.free = size**3
+
+	#Define initial frame where particle can stick
+	def paintFrame(self, frame):
+		size = self.size
+		if frame == 'bottom':
+			self.flags[:, :, 0] = OCCUPIED
+		elif frame == 'origin':
+			(x, y, z) = np.ogrid[-originRadius:originRadius + 1, -originRadius:originRadius + 1, -originRadius:originRadius + 1]
+			(c0, c1) = (size/2 - originRadius, size/2 + originRadius + 1)
+			self.flags[c0:c1, c0:c1, c0:c1][x**2 + y**2 + z**2 <= originRadius**2] = OCCUPIED
+		else:
+			raise Exception("Frame type parameter [bottom|origin]")
+
+	#Mark as sticky every free voxel adjacent to an occupied one. The frame
+	#is small, so only its bounding box, grown by one voxel, is dilated
+	def updateSticky(self):
+		size = self.size
+		occupied = np.nonzero(self.flags == OCCUPIED)
+		box = tuple( slice( max(int(c.min()) - 1, 0), min(int(c.max()) + 2, size) ) for c in occupied )
+		mask = self.flags[box] == OCCUPIED
+		near = np.zeros_like(mask)
+		(w, h, d) = mask.shape
+		for dx, dy, dz in self.adjacency:
+			near[max(0, -dx):w - max(0, dx), max(0, -dy):h - max(0, dy), max(0, -dz):d - max(0, dz)] |= \
+				mask[max(0, dx):w - max(0, -dx), max(0, dy):h - max(0, -dy), max(0, dz):d - max(0, -dz)]
+		self.flags[box][near & ~mask] = STICKY
+		self.free = size**3 - len(occupied[0])
+
+	def occupiedSites(self):
+		return np.nonzero(self.flags == OCCUPIED)
+
+	#Flag as kill voxels the free voxels where outside(x0, x1), a boolean
+	#array for the slabs x0 to x1, is set, and free the other ones
+	def markKill(self, outside):
+		for x0 in range(0, self.size, slabSize):
+			x1 = min(x0 + slabSize, self.size)
+			flags = self.flags[x0:x1]
+			out = outside(x0, x1)
+			flags[(flags == KILL) & ~out] = EMPTY
+			flags[(flags == EMPTY) & out] = KILL
+
+	#Get a random free voxel where a new particle can start its random walk
+	def randomFreeSite(self, rand):
+		size = self.size
+		sites = self.sites
+		while True:
+			(x, y, z) = ( int(rand() * size), int(rand() * size), int(rand() * size) )
+			if sites[(x * size + y) * size + z] != OCCUPIED:
+				return (x, y, z)
+
+	#Apply brownian motion from a position until reaching a sticky voxel
+	#Do not bounce on volume limits. Return None if reaching a kill voxel
+	def walk(self, x, y, z, rand):
+		size = self.size
+		sites = self.sites
+		adjacency = self.adjacency
+		moves = len(adjacency)
+		while sites[(x * size + y) * size + z] < STICKY:
+			(dx, dy, dz) = adjacency[ int(rand() * moves) ]
+			if 0 <= x + dx < size:
+				x += dx
+			if 0 <= y + dy < size:
+				y += dy
+			if 0 <= z + dz < size:
+				z += dz
+		if sites[(x * size + y) * size + z] == KILL:
+			return None
+		return (x, y, z)
+
+	#Stick a new particle on a sticky voxel and make its free neighbours sticky
+	def stick(self, x, y, z):
+		size = self.size
+		sites = self.sites
+		self.count += 1
+		self.free -= 1
+		sites[(x * size + y) * size + z] = OCCUPIED
+		self.xs.append(x)
+		self.ys.append(y)
+		self.zs.append(z)
+		for dx, dy, dz in self.adjacency:
+			if (0 <= x + dx < size) and (0 <= y + dy < size) and (0 <= z + dz < size):
+				index = ((x + dx) * size + y + dy) * size + z + dz
+				if sites[index] == EMPTY:
+					sites[index] = STICKY
+
+	#Save the particles as a point cloud: rows x, y, z, arrival order
+	#as a text .xyz file or a .npy array
+	def writePoints(self, path):
+		points = np.column_stack( (self.xs, self.ys, self.zs, np.arange(1, self.count + 1)) ).astype(np.uint32)
+		if path.endswith('.npy'):
+			np.save(path, points)
+		else:
+			np.savetxt(path, points, fmt='%d')
+
+	#Save one PNG image per z slice: frame in white, particles colored by
+	#arrival order. Each slice is painted from the particles lying on it
+	def writeSlices(self, directory, colors, n_particles):
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		table = colorTable(colors)
+		(xs, ys, zs) = [ np.frombuffer(c, dtype=np.uint16) for c in (self.xs, self.ys, self.zs) ]
+		arrival = np.arange(1, self.count + 1)
+		order = np.argsort(zs, kind='mergesort')
+		bounds = np.searchsorted(zs[order], np.arange(self.size + 1))
+		for z in range(0, self.size):
+			rgb = np.zeros((self.size, self.size, 3), dtype=np.uint8)
+			rgb[self.flags[:, :, z] == OCCUPIED] = 255
+			k = order[bounds[z]:bounds[z + 1]]
+			rgb[xs[k], ys[k]] = table[ arrival[k] * len(table) // n_particles ]
+			#Images are written by rows, that is, along y
+			writePNG(os.path.join(directory, 'slice_%04d.png' % z), self.size, self.size, [rgb.transpose(1, 0, 2)])
+
+#Launch walkers on random free voxels of the whole volume
+class VolumeLauncher(UniformLauncher):
+
+	def update(self, x, y, z):
+		pass
+
+#Launch walkers on a sphere just outside the cluster grown around center,
+#the 3D version of CircleLauncher
+class SphereLauncher(CircleLauncher):
+
+	def __init__(self, volume, center, kill):
+		self.lattice = volume
+		self.center = center
+		self.kill = kill
+		self.killRadius = 0.0
+		(x, y, z) = volume.occupiedSites()
+		self.radius = math.sqrt( np.max( (x - center[0])**2 + (y - center[1])**2 + (z - center[2])**2 ) )
+		self.updateKill()
+
+	#Uniform point on the sphere: uniform height and angle around the z axis
+	def launch(self, rand):
+		r = self.radius + launchMargin
+		h = 2.0 * rand() - 1.0
+		angle = rand() * 2.0 * math.pi
+		ring = math.sqrt(1.0 - h * h)
+		last = self.lattice.size - 1
+		return tuple( min( max( int( round(c + r * u) ), 0), last )
+			for c, u in zip(self.center, (ring * math.cos(angle), ring * math.sin(angle), h)) )
+
+	def update(self, x, y, z):
+		r = math.sqrt( (x - self.center[0])**2 + (y - self.center[1])**2 + (z - self.center[2])**2 )
+		if r > self.radius:
+			self.radius = r
+			self.updateKill()
+
+	def outside(self, x0, x1):
+		size = self.lattice.size
+		(x, y, z) = np.ogrid[x0:x1, 0:size, 0:size]
+		return (x - self.center[0])**2 + (y - self.center[1])**2 + (z - self.center[2])**2 > self.killRadius**2
+
+#Launch walkers on a plane just above the highest particle, for the bottom
+#frame, the 3D version of LineLauncher
+class PlaneLauncher(LineLauncher):
+
+	def __init__(self, volume, kill):
+		self.lattice = volume
+		self.kill = kill
+		self.killRadius = 0.0
+		self.radius = np.max( volume.occupiedSites()[2] )
+		self.updateKill()
+
+	def launch(self, rand):
+		size = self.lattice.size
+		z = min( int(self.radius) + launchMargin, size - 1)
+		return ( int(rand() * size), int(rand() * size), z )
+
+	def update(self, x, y, z):
+		if z > self.radius:
+			self.radius = z
+			self.updateKill()
+
+	def outside(self, x0, x1):
+		size = self.lattice.size
+		z = np.arange(size)
+		return np.broadcast_to(z > self.killRadius, (x1 - x0, size, size))
+
+#Create the launcher for a launch mode and frame shape
+def getLauncher(volume, launch, frame, kill):
+	if launch == 'uniform':
+		return VolumeLauncher(volume)
+	elif launch == 'circle':
+		if frame == 'bottom':
+			return PlaneLauncher(volume, kill)
+		center = volume.size / 2
+		return SphereLauncher(volume, (center, center, center), kill)
+	else:
+		raise Exception("Launch parameter [uniform|circle]")
+
+#Simulation of DLA on the voxel volume, one walker at a time
+def voxelSimulation(volume, n_particles, rng = random, launcher = None, quiet = False):
+
+	rand = rng.random
+	if launcher is None:
+		launcher = VolumeLauncher(volume)
+
+	#Set up a progress bar to show calculations
+	bar = getProgressBar(quiet)
+	bar.start()
+
+	#Iterate over all n particles
+	for i in range(volume.count + 1, n_particles):
+
+		#Stop if there is no room left for new particles
+		if volume.free == 0:
+			break
+
+		#Launch a walker until it sticks instead of reaching a kill voxel
+		position = None
+		while position is None:
+			(x, y, z) = launcher.launch(rand)
+			position = volume.walk(x, y, z, rand)
+		volume.stick(*position)
+		launcher.update(*position)
+
+		#Update progress bar
+		if i % (n_particles / steps) == 0:
+			bar.update( int( float(i) / n_particles * steps) )
+
+	#Close the progress bar
+	bar.finish()
+
+def main():
+	#Parse command line arguments
+	parser = getCommandLineParser()
+	args = vars( parser.parse_args() )
+
+	size = args['s']
+	if args['p'] is None:
+		n_particles = args['n']
+	else:
+		n_particles = int(size**3 * args['p'])
+
+	if args['a'] == 26:
+		adjacency = adjacency26
+	elif args['a'] == 6:
+		adjacency = adjacency6
+	else:
+		raise Exception("Adjacency parameter [6|26]")
+
+	#Description of the simulation
+	print "Starting simulation for a ", size, "x", size, "x", size, " volume"
+	print "Number of particles: ", n_particles
+	print "Frame shape: ", args['f'], " Adjacency: ", args['a'], " Launch: ", args['l']
+
+	#Create the volume and paint the initial frame where particles can stick
+	volume = Volume(size, adjacency)
+	volume.paintFrame(args['f'])
+	volume.updateSticky()
+
+	#Simulate the DLA
+	rng = random if args['r'] is None else random.Random(args['r'])
+	launcher = getLauncher(volume, args['l'], args['f'], args['k'])
+	voxelSimulation(volume, n_particles, rng, launcher)
+
+	#Save the point cloud and the slices
+	if args['o'] is not None:
+		volume.writePoints(args['o'])
+	if args['slices'] is not None:
+		red = colour.Color("red")
+		blue = colour.Color("blue")
+		volume.writeSlices(args['slices'], list( red.range_to(blue, nColors) ), n_particles)
+
+
+if __name__ == "__main__":
+  main()
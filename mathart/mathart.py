@@ -1,7 +1,18 @@
 from PIL import Image, ImageDraw
 import colour
 import argparse
-from math import *
+import ast
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import math
+import operator
+import struct
+import zlib
+import multiprocessing
+import numpy as np
 from progressbar import *
 
 """A note on the parametrizations:
@@ -10,27 +21,71 @@ On the script.sh file, we can find some examples for executing this program.
 The parametrization use k as the index for each iteration and n as the 
 number of lines or circles we will be draw on the image.
 
-The parametrization is read directly by the eval() python function, so, it 
-should be a correct python expression.
+The parametrization is a python expression made of numbers, k, n, the
+constants pi and e, the operators + - * / // % ** and the functions of
+the functions table below. It is parsed once and evaluated with numpy for
+every k at the same time.
 
 """
 
 #Number of steps of the bar status
 steps = 100
 
+#Largest number of pixel fragments rasterized at once
+fragmentChunk = 4000000
+
+#Parametrizations and color tables already built by this process,
+#reused by the artworks of a batch
+parametrizations = {}
+colorTables = {}
+
+#Colormaps for the palettes, as evenly spaced color stops
+colormaps = { 'viridis' : ('#440154', '#3b528b', '#21918c', '#5ec962', '#fde725'),
+	'magma' : ('#000004', '#51127c', '#b73779', '#fc8961', '#fcfdbf'),
+	'inferno' : ('#000004', '#56106e', '#bb3754', '#f98e09', '#fcffa4'),
+	'plasma' : ('#0d0887', '#7e03a8', '#cc4778', '#f89540', '#f0f921'),
+	'grey' : ('#000000', '#ffffff') }
+
+#Functions allowed on the parametrizations
+functions = { 'sin' : np.sin, 'cos' : np.cos, 'tan' : np.tan,
+	'asin' : np.arcsin, 'acos' : np.arccos, 'atan' : np.arctan, 'atan2' : np.arctan2,
+	'sinh' : np.sinh, 'cosh' : np.cosh, 'tanh' : np.tanh,
+	'exp' : np.exp, 'log' : np.log, 'log10' : np.log10, 'sqrt' : np.sqrt,
+	'pow' : np.power, 'hypot' : np.hypot, 'abs' : np.abs, 'fabs' : np.fabs,
+	'floor' : np.floor, 'ceil' : np.ceil, 'degrees' : np.degrees, 'radians' : np.radians }
+
+#Constants allowed on the parametrizations
+constants = { 'pi' : math.pi, 'e' : math.e }
+
+#Operators allowed on the parametrizations, with python semantics
+operators = { ast.Add : operator.add, ast.Sub : operator.sub, ast.Mult : operator.mul,
+	ast.Div : operator.div, ast.FloorDiv : operator.floordiv, ast.Mod : operator.mod,
+	ast.Pow : operator.pow, ast.USub : operator.neg, ast.UAdd : operator.pos }
+
 def getCommandLineParser():
 	"""Parse command line argument parameters.
 	Return a dictionary with the parameters parsed.
     """
 	parser = argparse.ArgumentParser(description='Paint Math Art images composed of lines and circles.')
 	parser.add_argument('-s', default='1024', help='Create an image of size x size pixels', type=int)
-	parser.add_argument('-a', default=True, help='Apply antialiasing with subsampling: [True|False]', type=bool, required=False)
-	parser.add_argument('-S', default='10', help='Supersampling factor to avoid antialiasing. <10', type=int)
+	parser.add_argument('-a', default=True, help='Apply antialiasing: [True|False]', type=bool, required=False)
+	parser.add_argument('-S', default='10', help='Antialiased lines are 1/S pixels wide, as lines drawn on an image S times larger', type=int)
+	parser.add_argument('-m', default='over', help='Blending of the antialiased elements: [over|add], painted one over the other or added up by density', type=str, required=False)
+	parser.add_argument('-T', default='log', help='Tone mapping of the density of added up elements: [linear|log|gamma]', type=str, required=False)
+	parser.add_argument('-g', default='2.2', help='Exponent of the gamma tone mapping', type=float)
+	parser.add_argument('-t', default='2048', help='Render antialiased images larger than t x t pixels by tiles of that size, streamed to the output file, 0 for a single tile', type=int)
+	parser.add_argument('-j', help='Number of worker processes drawing the tiles, or the artworks of a batch, all cores by default', type=int, required=False)
+	parser.add_argument('--frames', help='Directory where a numbered PNG frame of the artwork is written every K elements drawn, or - to write raw RGB frames on stdout', type=str, required=False)
+	parser.add_argument('--frame-every', default='250', help='Number of elements K between frames', type=int, required=False)
+	parser.add_argument('--cache', help='Directory of a cache of evaluated parametrizations, reused by artworks with the same formulas, element and n', type=str, required=False)
+	parser.add_argument('--cache-size', default='1024', help='Size limit of the cache in MB, the least recently used geometries are removed beyond it', type=int, required=False)
+	parser.add_argument('-b', help='Manifest (.json or .toml) of a batch of artworks to draw, the other parameters are their defaults', type=str, required=False)
 	parser.add_argument('-n', default='10000', help='Number of lines/circles to draw', type=int)
 	parser.add_argument('-o', help='File name to save the image (.png)', type=str, required=False)	
 	parser.add_argument('-e', default='line', help='Base element: [line|circle]', type=str, required=False)
 	parser.add_argument('-c', default="black", help='Init Color, for color degrade', type=str, required=False)	
 	parser.add_argument('-C', default="black", help='End Color, for color degrade', type=str, required=False)	
+	parser.add_argument('-p', help='Color palette instead of the degrade from -c to -C: a colormap [viridis|magma|inferno|plasma|grey] or comma separated color stops', type=str, required=False)
 	parser.add_argument('-v', default="True", help='Verbose mode', type=bool, required=False)	
 	parser.add_argument('-X1', default="sin(108.0*pi*k/n)*sin(4.0*pi*k/n)", help='X1 formula for line elements', type=str, required=False)	
 	parser.add_argument('-Y1', default="cos(106.0*pi*k/n)*sin(4.0*pi*k/n)", help='Y1 formula for line elements', type=str, required=False)	
@@ -41,14 +96,179 @@ def getCommandLineParser():
 	parser.add_argument('-R', default="1.0/4.0*cos(40.0*pi*k/n)**2", help='Radius formula for circle', type=str, required=False)	
 	return parser
 
-def drawLines(image, parametrization, n, colorDegrade, statusBar):
+class Parametrization(object):
+	"""Formulas of a parametrization, parsed and validated once.
+
+	Each formula is compiled to a list of operations shared by all the
+	formulas, where equal subexpressions, like sin(4.0*pi*k/n) on the
+	four formulas of the lines, are a single operation computed once.
+	Only the names, operators and functions of the tables above are
+	allowed, so no arbitrary code is ever run.
+
+    Keyword arguments:
+    formulas -- List of formula strings
+    """
+
+	def __init__(self, formulas):
+		self.formulas = formulas
+		self.operations = []
+		self.slots = {}
+		self.outputs = [ self.compile(formula) for formula in formulas ]
+
+	def compile(self, formula):
+		"""Compile a formula, return the slot of its value"""
+		try:
+			tree = ast.parse(formula.strip(), mode='eval')
+		except SyntaxError:
+			raise Exception("Parametrization is not a correct expression: " + formula)
+		return self.node(tree.body, formula)
+
+	def slot(self, key, function, arguments):
+		"""Slot of the operation applying function to the values of the
+		argument slots, reusing an equal operation"""
+		if key not in self.slots:
+			self.slots[key] = len(self.operations)
+			self.operations.append( (function, arguments) )
+		return self.slots[key]
+
+	def node(self, node, formula):
+		"""Compile a node of the syntax tree of a formula"""
+		if isinstance(node, ast.Num):
+			return self.slot( ('number', type(node.n), node.n), None, node.n )
+
+		elif isinstance(node, ast.Name):
+			if node.id in ('k', 'n'):
+				return self.slot( ('name', node.id), None, node.id )
+			elif node.id in constants:
+				return self.slot( ('number', type(constants[node.id]), constants[node.id]), None, constants[node.id] )
+
+		elif isinstance(node, ast.BinOp) and type(node.op) in operators:
+			arguments = ( self.node(node.left, formula), self.node(node.right, formula) )
+			return self.slot( (type(node.op),) + arguments, operators[type(node.op)], arguments )
+
+		elif isinstance(node, ast.UnaryOp) and type(node.op) in operators:
+			arguments = ( self.node(node.operand, formula), )
+			return self.slot( (type(node.op),) + arguments, operators[type(node.op)], arguments )
+
+		elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in functions \
+			and not node.keywords and node.starargs is None and node.kwargs is None:
+			arguments = tuple( self.node(argument, formula) for argument in node.args )
+			return self.slot( (node.func.id,) + arguments, functions[node.func.id], arguments )
+
+		raise Exception("Parametrization not allowed, at '%s' of: %s" % (formula[node.col_offset:], formula))
+
+	def evaluate(self, n):
+		"""Evaluate the formulas for every k in [0, n)
+		Return a list with an array of n values for each formula
+		"""
+		values = []
+		for function, arguments in self.operations:
+			if function is not None:
+				values.append( function( *[ values[j] for j in arguments ] ) )
+			elif arguments == 'k':
+				values.append( np.arange(0, n) )
+			elif arguments == 'n':
+				values.append( n )
+			else:
+				values.append( arguments )
+		return [ np.broadcast_to( values[j], (n,) ).astype(float) for j in self.outputs ]
+
+class GeometryCache(object):
+	"""Cache on disk of evaluated parametrizations, the coordinates of the
+	elements in the [-1, 1] space, which do not depend on the colors, the
+	image size or the antialiasing.
+
+	Each geometry is a .npy file named by a hash of the element, the
+	formulas and n, loaded memory mapped. Loading a geometry refreshes its
+	modification time, and the least recently used ones are removed when
+	the files exceed the size limit.
+
+    Keyword arguments:
+    directory -- Directory of the cache files
+    limit -- Size limit of the cache, in bytes
+    """
+
+	def __init__(self, directory, limit):
+		self.directory = directory
+		self.limit = limit
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def path(self, element, formulas, n):
+		"""File of the geometry of the formulas for n elements"""
+		key = json.dumps( [element, list(formulas), n] )
+		return os.path.join( self.directory, hashlib.sha256( key.encode('utf-8') ).hexdigest() + '.npy' )
+
+	def evaluate(self, parametrization, element, n):
+		"""Evaluate a parametrization, or load it if it is on the cache
+		Return a list with an array of n values for each formula
+		"""
+		path = self.path(element, parametrization.formulas, n)
+		try:
+			values = np.load(path, mmap_mode='r')
+			os.utime(path, None)
+			return list(values)
+		except (IOError, OSError, ValueError):
+			pass
+		
+		values = parametrization.evaluate(n)
+		self.store(path, np.array(values))
+		return values
+
+	def store(self, path, values):
+		"""Write a geometry, renamed into place so other processes never
+		load it half written, and evict the least recently used ones"""
+		(handle, temporary) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+		with os.fdopen(handle, 'wb') as f:
+			np.save(f, values)
+		os.chmod(temporary, 0o644)
+		os.rename(temporary, path)
+		
+		files = []
+		for name in os.listdir(self.directory):
+			if name.endswith('.npy'):
+				try:
+					stat = os.stat( os.path.join(self.directory, name) )
+					files.append( (stat.st_mtime, stat.st_size, name) )
+				except OSError:
+					pass
+		total = sum( size for used, size, name in files )
+		for used, size, name in sorted(files):
+			if total <= self.limit or name == os.path.basename(path):
+				continue
+			try:
+				os.remove( os.path.join(self.directory, name) )
+			except OSError:
+				pass
+			total -= size
+
+class CachedParametrization(object):
+	"""Parametrization evaluated through a GeometryCache
+
+    Keyword arguments:
+    parametrization -- The Parametrization of the elements
+    element -- Base element of the parametrization
+    cache -- The GeometryCache
+    """
+
+	def __init__(self, parametrization, element, cache):
+		self.parametrization = parametrization
+		self.formulas = parametrization.formulas
+		self.element = element
+		self.cache = cache
+
+	def evaluate(self, n):
+		"""Evaluate the formulas for every k in [0, n), or load them"""
+		return self.cache.evaluate(self.parametrization, self.element, n)
+
+def drawLines(image, parametrization, n, colorTable, statusBar):
 	"""Draw the set of lines in the image according to a parametrization
 
     Keyword arguments:
     image -- The Image object where the lines will be drawn.
-    parametrization -- The parametrization of each segment ((X1, Y1), (X2, Y2))
+    parametrization -- The Parametrization of each segment (X1, Y1, X2, Y2)
     n -- Number of lines to be drawn
-    colorDegrade -- List with colors we will use to pain the lines
+    colorTable -- Array (nColors, 3) with the colors we will use to pain the lines
     statusBar -- Status bar to show progress of this function
     """
     
@@ -56,41 +276,33 @@ def drawLines(image, parametrization, n, colorDegrade, statusBar):
 	drawer = ImageDraw.Draw(image) 
 	size = image.size[0]
 	
-	#Number of colors for the color degrade
-	nColors = len( colorDegrade )
+	#Get the color of every line from the color table
+	colors = [ tuple(color) for color in elementColors(colorTable, n).tolist() ]
+	
+	#Get initial and end point of the segments, according to parametrization
+	#Transform coordenates [-1, 1] to the image coordenate system [0, size]
+	coords = [ (coord + 1.0)/2.0*size for coord in parametrization.evaluate(n) ]
 	
 	#Repeat for the n lines
 	for k in range(0, n):			
-		#Get initial and end point of the segment, according to parametrization
-		X1 = eval(parametrization[0])
-		Y1 = eval(parametrization[1])
-		X2 = eval(parametrization[2])
-		Y2 = eval(parametrization[3])
-		
-		#Transform coordenates [-1, 1] to the image coordenate system [0, size]
-		coord = (X1, Y1, X2, Y2)
-		coord_adjusted = [ (coord[j] + 1.0)/2.0*size for j in range(0,4) ]
-		
-		#Get a color from the color degrade
-		colorIndex = int( float(k) / n * nColors )
-		color = color = tuple( [ int(j*255) for j in colorDegrade[colorIndex].rgb ] )
+		coord_adjusted = [ float(coord[k]) for coord in coords ]
 		
 		#Draw the line
-		drawer.line(coord_adjusted, fill=color, width=1)	
+		drawer.line(coord_adjusted, fill=colors[k], width=1)	
 		
 		#Update progress bar
 		if k % (n / steps) == 0:
 			statusBar.update( int( float(k) / n * steps) )
 			
 				
-def drawCircles(image, parametrization, n, colorDegrade, statusBar):
+def drawCircles(image, parametrization, n, colorTable, statusBar):
 	"""Draw the set of circles in the image according to a parametrization
 
     Keyword arguments:
     image -- The Image object where the lines will be drawn.
-    parametrization -- The parametrization of each circle ((Xc, Yc), Radius)
+    parametrization -- The Parametrization of each circle (Xc, Yc, Radius)
     n -- Number of circles to be drawn
-    colorDegrade -- List with colors we will use to pain the lines
+    colorTable -- Array (nColors, 3) with the colors we will use to pain the circles
     statusBar -- Status bar to show progress of this function
     """
     
@@ -98,78 +310,629 @@ def drawCircles(image, parametrization, n, colorDegrade, statusBar):
 	drawer = ImageDraw.Draw(image) 
 	size = image.size[0]
 	
-	#Number of colors for colros degrade
-	nColors = len( colorDegrade )
+	#Get the color of every circle from the color table
+	colors = [ tuple(color) for color in elementColors(colorTable, n).tolist() ]
+	
+	#Get center and radius of the circles from parametrization
+	(X, Y, r) = parametrization.evaluate(n)
+	
+	#Get coordenates of bounding boxes in [-1, 1] space
+	#Transform coordenates of the bounding box. Observe that 
+	#to avoid cropping circles we have had to add 
+	#an extra space on the image size.
+	boxes = [ (box + 1.0 + 1.0/4.0)/(2.0 + 2.0 / 4.0)*size for box in (X-r, Y-r, X+r, Y+r) ]
 	
 	#For each circle
 	for k in range(0, n):
-		#Get center and radius of the circle from parametrization
-		X = eval(parametrization[0])
-		Y = eval(parametrization[1])
-		r = eval(parametrization[2])
-		
-		
-		#Get coordenates of bounding box in [-1, 1] space
-		box = (X-r, Y-r, X+r, Y+r)
-		
-		#Transform coordenates of the bounding box. Observe that 
-		#to avoid cropping circles we have had to add 
-		#an extra space on the image size.
-		box_adjusted = [ (box[j] + 1.0 + 1.0/4.0)/(2.0 + 2.0 / 4.0)*size for j in range(0,4) ]
-		
-		#Get a color from the color degrade
-		colorIndex = int( float(k) / n * nColors )
-		color = tuple( [ int(j*255) for j in colorDegrade[colorIndex].rgb ] )
+		box_adjusted = [ float(box[k]) for box in boxes ]
 		
 		#Draw the circle
-		drawer.ellipse(box_adjusted, outline=color)	
+		drawer.ellipse(box_adjusted, outline=colors[k])	
 		
 		#Update progress bar
 		if k % (n / steps) == 0:
 			statusBar.update( int( float(k) / n * steps) )
 	
 	
-def main():
-	"""Main method of the program. Parse the command line argumen
-	and draw the lines or circles on the image. Show the image and
-	eventually save the result in an output file.
+def spans(first, last):
+	"""Expand the integer ranges [first, last] of a set of elements
+
+    Keyword arguments:
+    first -- Array with the first position of each element
+    last -- Array with the last position of each element
+    Return the element index and the position of each point of the ranges
     """
-    
-	#Parse command line arguments
-	parser = getCommandLineParser()
-	#parser.print_help()
-	#Get arguments as a hash table
-	args = vars( parser.parse_args() )
+	counts = np.maximum(last - first + 1, 0)
+	element = np.repeat( np.arange(len(first)), counts )
+	offset = np.arange( counts.sum() ) - np.repeat( np.cumsum(counts) - counts, counts )
+	return (element, first[element] + offset)
+
+def splitMinor(element, major, minor, weight, steep):
+	"""Split each point of a curve between the two pixels of the minor axis
+	closest to it, as Wu's algorithm does: the nearer pixel gets the larger
+	share of the weight. Pixel centers are at integer + 0.5 coordinates.
+	The fragments keep the order of the points.
+
+    Keyword arguments:
+    element -- Array with the element index of each point
+    major -- Array with the pixel of each point along the major axis
+    minor -- Array with the exact coordinate of each point along the minor axis
+    weight -- Array with the coverage of each point
+    steep -- Whether the major axis of each point is y instead of x
+    Return the element index, x, y and coverage of each pixel fragment
+    """
+	row = np.floor(minor - 0.5)
+	frac = minor - 0.5 - row
+	pair = lambda first, second: np.column_stack( (first, second) ).ravel()
+	(element, major, steep) = ( np.repeat(element, 2), np.repeat(major, 2), np.repeat(steep, 2) )
+	minor = pair(row, row + 1).astype(np.int64)
+	weight = pair(weight * (1.0 - frac), weight * frac)
+	return ( element, np.where(steep, minor, major), np.where(steep, major, minor), weight )
+
+def segmentFragments(x0, y0, x1, y1, window = None):
+	"""Coverage of the pixels crossed by 1 pixel wide segments, with Wu's
+	algorithm: each pixel along the major axis is covered by the length of
+	the segment within it, split between the two pixels of the minor axis.
+
+    Keyword arguments:
+    x0, y0, x1, y1 -- Arrays with the end points of the segments, in pixels
+    window -- Pixels (x0, y0, x1, y1) of the major axis to walk, all if None
+    Return the element index, x, y and coverage of each pixel fragment
+    """
+	steep = np.abs(y1 - y0) > np.abs(x1 - x0)
+	(u0, v0, u1, v1) = ( np.where(steep, y0, x0), np.where(steep, x0, y0), np.where(steep, y1, x1), np.where(steep, x1, y1) )
+	
+	#Walk each segment with increasing major coordinate
+	swap = u1 < u0
+	(u0, v0, u1, v1) = ( np.where(swap, u1, u0), np.where(swap, v1, v0), np.where(swap, u0, u1), np.where(swap, v0, v1) )
+	length = u1 - u0
+	gradient = np.where(length > 0, (v1 - v0) / np.where(length > 0, length, 1.0), 0.0)
+	
+	(first, last) = ( np.floor(u0).astype(np.int64), np.floor(u1).astype(np.int64) )
+	if window is not None:
+		first = np.maximum( first, np.where(steep, window[1], window[0]) )
+		last = np.minimum( last, np.where(steep, window[3], window[2]) )
+	(element, major) = spans(first, last)
+	
+	#Part of the segment on each pixel of the major axis, and its middle
+	(start, end) = ( np.maximum(major, u0[element]), np.minimum(major + 1, u1[element]) )
+	minor = v0[element] + gradient[element] * ( (start + end) / 2.0 - u0[element] )
+	return splitMinor(element, major, minor, end - start, steep[element])
+
+def circleFragments(cx, cy, r, window = None):
+	"""Coverage of the pixels crossed by 1 pixel wide circle outlines, with
+	Wu's algorithm: the arcs closer to horizontal are walked along x, the
+	others along y, and each point is split between two pixels.
+
+    Keyword arguments:
+    cx, cy, r -- Arrays with the centers and radius of the circles, in pixels
+    window -- Pixels (x0, y0, x1, y1) of the major axis to walk, all if None
+    Return the element index, x, y and coverage of each pixel fragment
+    """
+	r = np.abs(r)
+	reach = r / math.sqrt(2.0)
+	
+	#Pixels of each major axis strictly within the octants of the arcs
+	firsts = [ np.ceil(center - reach - 0.5).astype(np.int64) for center in (cx, cy) ]
+	lasts = [ np.floor(center + reach - 0.5).astype(np.int64) for center in (cx, cy) ]
+	if window is not None:
+		firsts = [ np.maximum(firsts[0], window[0]), np.maximum(firsts[1], window[1]) ]
+		lasts = [ np.minimum(lasts[0], window[2]), np.minimum(lasts[1], window[3]) ]
+	counts = [ np.maximum(last - first + 1, 0) for first, last in zip(firsts, lasts) ]
+	
+	#The four arcs of each circle one after the other, so the fragments
+	#are in the order of the circles: below and above along x, then left
+	#and right along y
+	(element, position) = spans( np.zeros(len(r), dtype=np.int64), 2 * (counts[0] + counts[1]) - 1 )
+	steep = position >= 2 * counts[0][element]
+	position = np.where(steep, position - 2 * counts[0][element], position)
+	count = np.where(steep, counts[1][element], counts[0][element])
+	sign = np.where(position < count, -1.0, 1.0)
+	major = np.where(steep, firsts[1][element], firsts[0][element]) + position % np.maximum(count, 1)
+	(center, other) = ( np.where(steep, cy[element], cx[element]), np.where(steep, cx[element], cy[element]) )
+	
+	offset = major + 0.5 - center
+	inside = np.abs(offset) < reach[element]
+	(element, major, offset, other, sign, steep) = (element[inside], major[inside], offset[inside], other[inside], sign[inside], steep[inside])
+	height = np.sqrt( np.maximum(r[element]**2 - offset**2, 0.0) )
+	return splitMinor(element, major, other + sign * height, np.ones(len(element)), steep)
+
+def composite(buffer, pixel, element, alpha, colors):
+	"""Paint fragments over the buffer element after element, each one on
+	top of the previous ones
+
+    Keyword arguments:
+    buffer -- Float RGB array (size*size, 3) of the image
+    pixel -- Array with the flat pixel index of each fragment
+    element -- Array with the element index of each fragment, in order
+    alpha -- Array with the opacity of each fragment
+    colors -- Array (elements, 3) with the color of each element
+    """
+	bounds = np.searchsorted( element, np.arange(0, len(colors) + 1) )
+	alpha = alpha[:, None]
+	for i in range(0, len(colors)):
+		(start, stop) = (bounds[i], bounds[i + 1])
+		if start == stop:
+			continue
+		target = pixel[start:stop]
+		opacity = alpha[start:stop]
+		buffer[target] = buffer[target] * (1.0 - opacity) + colors[i] * opacity
+
+def accumulate(buffer, density, pixel, weight, color):
+	"""Add the coverage of the fragments to the density of their pixels,
+	and their colors weighted by their coverage to the buffer, in any order
+
+    Keyword arguments:
+    buffer -- Float RGB array (size*size, 3) with the sum of colors
+    density -- Float array (size*size) with the sum of coverages
+    pixel -- Array with the flat pixel index of each fragment
+    weight -- Array with the coverage of each fragment
+    color -- Array (fragments, 3) with the color of each fragment
+    """
+	density += np.bincount( pixel, weights = weight, minlength = len(density) )
+	for channel in range(0, 3):
+		buffer[:, channel] += np.bincount( pixel, weights = weight * color[:, channel], minlength = len(density) )
+
+def toneMap(buffer, density, tone, gamma, peak = None):
+	"""Blend the mean color of each pixel over a white background, by
+	its density of elements mapped to an intensity in [0, 1]
+
+    Keyword arguments:
+    buffer -- Float RGB array (height, width, 3) with the sum of colors
+    density -- Float array (height, width) with the sum of coverages
+    tone -- Tone mapping of the density: [linear|log|gamma]
+    gamma -- Exponent of the gamma tone mapping
+    peak -- Density mapped to the full intensity, the largest one if None
+    Return the image as an uint8 RGB array
+    """
+	if peak is None:
+		peak = density.max()
+	peak = max(peak, 1e-12)
+	
+	if tone == 'linear':
+		intensity = density / peak
+	elif tone == 'log':
+		intensity = np.log1p(density) / np.log1p(peak)
+	elif tone == 'gamma':
+		intensity = (density / peak) ** (1.0 / gamma)
+	else:
+		raise Exception("Tone mapping parameter [linear|log|gamma]")
+	intensity = np.minimum(intensity, 1.0)[:, :, None]
+	
+	color = buffer / np.maximum(density, 1e-12)[:, :, None]
+	return np.clip( np.round( 255.0 * (1.0 - intensity) + color * intensity ), 0, 255 ).astype(np.uint8)
+
+def rasterize(buffer, fragments, elements, costs, colors, width, statusBar = None, origin = (0, 0), density = None):
+	"""Draw anti-aliased elements on a float RGB buffer, in chunks of elements
+	so the fragments are bounded in memory. The elements are painted one
+	over the other, or added up on the buffer and the density if given
+
+    Keyword arguments:
+    buffer -- Float RGB array (height, width, 3) of the image or of a tile
+    fragments -- Function from arrays of element parameters to their fragments
+    elements -- Arrays with the parameters of the elements, in pixels
+    costs -- Array with a bound of the number of fragments of each element
+    colors -- Array (n, 3) with the color of each element
+    width -- Width of the elements, in pixels, which scales the coverages
+    statusBar -- Status bar to show progress of this function, if any
+    origin -- Pixel (x, y) of the image at the top left corner of the buffer
+    density -- Float array (height, width) with the sum of coverages, if adding
+    """
+	(height, size) = buffer.shape[0:2]
+	flat = buffer.reshape(height * size, 3)
+	window = ( origin[0], origin[1], origin[0] + size - 1, origin[1] + height - 1 )
+	n = len(colors)
+	
+	#Chunks of elements with fragmentChunk fragments at most, or a single element
+	bounds = np.searchsorted( np.cumsum(costs), np.arange(1, int(np.sum(costs) // fragmentChunk) + 1) * fragmentChunk )
+	bounds = np.unique( np.concatenate( ([0], np.maximum(bounds, 1), [n]) ) )
+	
+	for start, stop in zip(bounds[:-1], bounds[1:]):
+		(element, x, y, coverage) = fragments( *[ parameter[start:stop] for parameter in elements ], window = window )
+		(x, y) = (x - origin[0], y - origin[1])
+		inside = (0 <= x) & (x < size) & (0 <= y) & (y < height) & (coverage > 0)
+		(element, x, y, coverage) = (element[inside], x[inside], y[inside], coverage[inside])
+		if density is None:
+			composite(flat, y * size + x, element, np.minimum(coverage * width, 1.0), colors[start:stop])
+		else:
+			accumulate(flat, density.reshape(height * size), y * size + x, coverage * width, colors[start:stop][element])
+		if statusBar is not None:
+			statusBar.update( int( float(stop) / n * steps) )
+
+def lineElements(parametrization, n, size):
+	"""Segments of the lines on an image of size x size pixels
+
+    Keyword arguments:
+    parametrization -- The Parametrization of each segment (X1, Y1, X2, Y2)
+    n -- Number of lines to be drawn
+    size -- Size of the image
+    Return the fragments function, the arrays (X1, Y1, X2, Y2) in pixels,
+    a bound of the fragments of each line and their bounding boxes
+    """
+	#Transform coordenates [-1, 1] to the image coordenate system [0, size]
+	coords = [ (coord + 1.0)/2.0*size for coord in parametrization.evaluate(n) ]
+	
+	#Two fragments for each pixel along the major axis
+	costs = 2 * ( np.maximum( np.abs(coords[2] - coords[0]), np.abs(coords[3] - coords[1]) ) + 2 )
+	
+	#The fragments reach a pixel beyond the segments on the minor axis
+	boxes = ( np.minimum(coords[0], coords[2]) - 1, np.minimum(coords[1], coords[3]) - 1,
+		np.maximum(coords[0], coords[2]) + 1, np.maximum(coords[1], coords[3]) + 1 )
+	return (segmentFragments, coords, costs, boxes)
+
+def circleElements(parametrization, n, size):
+	"""Circles on an image of size x size pixels
+
+    Keyword arguments:
+    parametrization -- The Parametrization of each circle (Xc, Yc, Radius)
+    n -- Number of circles to be drawn
+    size -- Size of the image
+    Return the fragments function, the arrays (Xc, Yc, Radius) in pixels,
+    a bound of the fragments of each circle and their bounding boxes
+    """
+	(X, Y, r) = parametrization.evaluate(n)
+	
+	#Observe that to avoid cropping circles the [-1, 1] space is
+	#extended by 1/4 on each side
+	circles = ( (X + 1.0 + 1.0/4.0)/(2.0 + 2.0 / 4.0)*size, (Y + 1.0 + 1.0/4.0)/(2.0 + 2.0 / 4.0)*size, r/(2.0 + 2.0 / 4.0)*size )
+	
+	#Two fragments for each pixel along the major axis of 4 arcs of each octant pair
+	costs = 16 * ( np.abs(circles[2]) / math.sqrt(2.0) + 2 )
+	
+	reach = np.abs(circles[2]) + 1
+	boxes = ( circles[0] - reach, circles[1] - reach, circles[0] + reach, circles[1] + reach )
+	return (circleFragments, circles, costs, boxes)
+
+def rasterLines(buffer, parametrization, n, colorTable, statusBar, width = 1.0, density = None):
+	"""Draw the set of lines on a float RGB buffer, anti-aliased
+
+    Keyword arguments:
+    buffer -- Float RGB array (size, size, 3) of the image
+    parametrization -- The Parametrization of each segment (X1, Y1, X2, Y2)
+    n -- Number of lines to be drawn
+    colorTable -- Array (nColors, 3) with the colors we will use to pain the lines
+    statusBar -- Status bar to show progress of this function
+    width -- Width of the lines, in pixels
+    density -- Float array (size, size) with the sum of coverages, if adding
+    """
+	(fragments, coords, costs, boxes) = lineElements(parametrization, n, buffer.shape[0])
+	rasterize(buffer, fragments, coords, costs, elementColors(colorTable, n), width, statusBar, density = density)
+
+def rasterCircles(buffer, parametrization, n, colorTable, statusBar, width = 1.0, density = None):
+	"""Draw the set of circles on a float RGB buffer, anti-aliased
+
+    Keyword arguments:
+    buffer -- Float RGB array (size, size, 3) of the image
+    parametrization -- The Parametrization of each circle (Xc, Yc, Radius)
+    n -- Number of circles to be drawn
+    colorTable -- Array (nColors, 3) with the colors we will use to pain the circles
+    statusBar -- Status bar to show progress of this function
+    width -- Width of the circle outlines, in pixels
+    density -- Float array (size, size) with the sum of coverages, if adding
+    """
+	(fragments, circles, costs, boxes) = circleElements(parametrization, n, buffer.shape[0])
+	rasterize(buffer, fragments, circles, costs, elementColors(colorTable, n), width, statusBar, density = density)
+
+def binTiles(boxes, size, tile):
+	"""Elements touching each tile of an image, by their bounding boxes
+
+    Keyword arguments:
+    boxes -- Arrays (x0, y0, x1, y1) with the bounding box of each element
+    size -- Size of the image
+    tile -- Size of the tiles
+    Return a list with the array of the elements of each tile, in drawing
+    order, for the tiles by rows from the top left corner
+    """
+	tiles = (size + tile - 1) // tile
+	(x0, y0, x1, y1) = boxes
+	
+	#Skip the elements outside of the image
+	visible = np.nonzero( (x1 >= 0) & (y1 >= 0) & (x0 < size) & (y0 < size) )[0]
+	(tx0, ty0, tx1, ty1) = [ np.clip( np.floor(coord[visible] / tile ), 0, tiles - 1 ).astype(np.int64) for coord in boxes ]
+	
+	#One entry for each tile of the box of each element
+	columns = tx1 - tx0 + 1
+	(entry, position) = spans( np.zeros(len(visible), dtype=np.int64), columns * (ty1 - ty0 + 1) - 1 )
+	index = (ty0[entry] + position // columns[entry]) * tiles + tx0[entry] + position % columns[entry]
+	
+	#A stable sort keeps the drawing order within each tile
+	order = np.argsort(index, kind='mergesort')
+	bounds = np.searchsorted( index[order], np.arange(0, tiles * tiles + 1) )
+	elements = visible[entry[order]]
+	return [ elements[bounds[i]:bounds[i + 1]] for i in range(0, tiles * tiles) ]
+
+def accumulateTile(fragments, elements, costs, colors, width, origin, shape):
+	"""Add up the elements touching a tile on buffers of its own
+	Return the sum of colors and the density of the tile
+	"""
+	buffer = np.zeros( shape + (3,), dtype=np.float32 )
+	density = np.zeros( shape, dtype=np.float32 )
+	rasterize(buffer, fragments, elements, costs, colors, width, None, origin, density)
+	return (buffer, density)
+
+def tilePeak(*task):
+	"""Largest density of a tile, added up as accumulateTile does"""
+	return float( accumulateTile(*task)[1].max() )
+
+def renderTile(fragments, elements, costs, colors, width, origin, shape, tone = None):
+	"""Draw the elements touching a tile on a buffer of its own
+
+    Keyword arguments:
+    fragments -- Function from arrays of element parameters to their fragments
+    elements -- Arrays with the parameters of the elements, in pixels
+    costs -- Array with a bound of the number of fragments of each element
+    colors -- Array (n, 3) with the color of each element
+    width -- Width of the elements, in pixels
+    origin -- Pixel (x, y) of the image at the top left corner of the tile
+    shape -- Height and width of the tile
+    tone -- Tone mapping, gamma and peak density if adding the elements up
+    Return the tile as an uint8 RGB array
+    """
+	if tone is not None:
+		(buffer, density) = accumulateTile(fragments, elements, costs, colors, width, origin, shape)
+		return toneMap(buffer, density, *tone)
+	
+	buffer = np.full( shape + (3,), 255.0, dtype=np.float32 )
+	rasterize(buffer, fragments, elements, costs, colors, width, None, origin)
+	return np.clip( np.round(buffer), 0, 255 ).astype(np.uint8)
+
+def tileBands(elements, colors, width, size, tile, workers, statusBar, tone = None):
+	"""Draw an image by tiles, in worker processes if more than one, and
+	stitch each row of tiles into a band of rows of the image. The tiles
+	of a row are drawn while the previous band is written. Elements added
+	up are drawn twice, first to find the peak density of the image.
+
+    Keyword arguments:
+    elements -- Fragments function, parameters, costs and boxes of the elements
+    colors -- Array (n, 3) with the color of each element
+    width -- Width of the elements, in pixels
+    size -- Size of the image
+    tile -- Size of the tiles
+    workers -- Number of worker processes
+    statusBar -- Status bar to show progress of this function
+    tone -- Tone mapping and gamma if adding the elements up, None to paint them
+    Return a generator of the bands as uint8 RGB arrays, top to bottom
+    """
+	(fragments, parameters, costs, boxes) = elements
+	binned = binTiles(boxes, size, tile)
+	tiles = (size + tile - 1) // tile
+	
+	def tasks(row):
+		for column in range(0, tiles):
+			chosen = binned[row * tiles + column]
+			origin = (column * tile, row * tile)
+			shape = ( min(tile, size - origin[1]), min(tile, size - origin[0]) )
+			yield ( fragments, [ parameter[chosen] for parameter in parameters ], costs[chosen], colors[chosen], width, origin, shape )
+	
+	pool = multiprocessing.Pool(workers) if workers > 1 else None
+	if pool is not None:
+		run = lambda function, task, *extra: pool.apply_async(function, task + extra)
+		collect = lambda results: [ result.get() for result in results ]
+	else:
+		run = lambda function, task, *extra: (function, task + extra)
+		collect = lambda pending: [ function(*task) for function, task in pending ]
+	
+	try:
+		#The peak density of the whole image maps the densities of every tile
+		extra = ()
+		if tone is not None:
+			peak = max( collect([ run(tilePeak, task) for row in range(0, tiles) for task in tasks(row) ]) )
+			extra = ( tuple(tone) + (peak,), )
 		
+		submit = lambda row: [ run(renderTile, task, *extra) for task in tasks(row) ]
+		pending = submit(0)
+		for row in range(0, tiles):
+			current = pending
+			if row + 1 < tiles:
+				pending = submit(row + 1)
+			yield np.concatenate( collect(current), axis = 1 )
+			statusBar.update( int( float(row + 1) / tiles * steps) )
+	finally:
+		if pool is not None:
+			pool.terminate()
+			pool.join()
+
+def bufferImage(buffer, density = None, tone = None):
+	"""Round the antialiased buffer to 8 bits per channel, or map the
+	density of the added up elements with the tone mapping and gamma
+	Return the image as an uint8 RGB array
+	"""
+	if density is not None:
+		return toneMap(buffer, density, *tone)
+	return np.clip( np.round(buffer), 0, 255 ).astype(np.uint8)
+
+class Frames(object):
+	"""Frames of an animation, written as numbered PNG files on a
+	directory, or as raw RGB frames on a stream
+
+    Keyword arguments:
+    directory -- Directory of the PNG files
+    stream -- File object where the raw frames are written
+    """
+
+	def __init__(self, directory = None, stream = None):
+		self.directory = directory
+		self.stream = stream
+		self.count = 0
+		if directory is not None and not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def emit(self, rgb):
+		"""Write the next frame, an uint8 RGB array"""
+		(height, width) = rgb.shape[:2]
+		if self.directory is not None:
+			writePNG( os.path.join(self.directory, 'frame_%06d.png' % self.count), width, height, [rgb] )
+		if self.stream is not None:
+			self.stream.write( rgb.tobytes() )
+			self.stream.flush()
+		self.count += 1
+
+def animate(buffer, elements, colors, width, interval, frames, statusBar, density = None, tone = None):
+	"""Draw the elements on the buffer interval elements at a time, and
+	emit a frame after each of them. Every frame only draws its new
+	elements over the previous ones, so the whole animation costs as much
+	as drawing the artwork once, plus writing the frames.
+
+    Keyword arguments:
+    buffer -- Float RGB array (size, size, 3) of the image
+    elements -- Fragments function, parameters, costs and boxes of the elements
+    colors -- Array (n, 3) with the color of each element
+    width -- Width of the elements, in pixels
+    interval -- Number of elements between frames
+    frames -- The Frames where the animation is written
+    statusBar -- Status bar to show progress of this function
+    density -- Float array (size, size) with the sum of coverages, if adding
+    tone -- Tone mapping and gamma of the frames, if adding
+    """
+	(fragments, parameters, costs, boxes) = elements
+	n = len(colors)
+	for start in range(0, n, interval):
+		stop = min(start + interval, n)
+		rasterize(buffer, fragments, [ parameter[start:stop] for parameter in parameters ], costs[start:stop], colors[start:stop], width, None, (0, 0), density)
+		frames.emit( bufferImage(buffer, density, tone) )
+		statusBar.update( int( float(stop) / n * steps) )
+
+def writePNG(path, width, height, bands):
+	"""Write a RGB PNG file from bands of rows, so that the whole image
+	never has to be in memory
+
+    Keyword arguments:
+    path -- File name of the image
+    width, height -- Size of the image
+    bands -- Iterable of uint8 arrays (rows, width, 3), top to bottom
+    """
+	def chunk(f, kind, data):
+		f.write( struct.pack('>I', len(data)) )
+		f.write(kind + data)
+		f.write( struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff) )
+	
+	with open(path, 'wb') as f:
+		f.write(b'\x89PNG\r\n\x1a\n')
+		chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+		compressor = zlib.compressobj()
+		for band in bands:
+			#Each row starts with its filter type, none
+			rows = np.zeros( (len(band), 3 * width + 1), dtype=np.uint8 )
+			rows[:, 1:] = band.reshape(len(band), 3 * width)
+			data = compressor.compress( rows.tobytes() )
+			if len(data) > 0:
+				chunk(f, b'IDAT', data)
+		chunk(f, b'IDAT', compressor.flush())
+		chunk(f, b'IEND', b'')
+
+def elementColors(colorTable, n):
+	"""Array (n, 3) with the color of each element k, gathered at once from
+	the color table"""
+	return colorTable[ (np.arange(0, n) * len(colorTable)) // n ]
+	
+def getParametrization(formulas):
+	"""Parametrization of the formulas, compiled once per process"""
+	formulas = tuple(formulas)
+	if formulas not in parametrizations:
+		parametrizations[formulas] = Parametrization(formulas)
+	return parametrizations[formulas]
+
+def getColorTable(palette, nColors = 256):
+	"""Lookup table of the colors of a palette, built once per process
+
+    Keyword arguments:
+    palette -- Name of a colormap of the colormaps table, or a comma
+        separated list of color stops (names or #rrggbb), with a color
+        degrade between each pair like the one from -c to -C
+    nColors -- Number of colors of the table
+    Return an uint8 array (nColors, 3) with the colors
+    """
+	if (palette, nColors) in colorTables:
+		return colorTables[(palette, nColors)]
+	
+	if palette in colormaps:
+		#Colormaps are interpolated in RGB between their evenly spaced stops
+		stops = np.array([ colour.Color(stop).rgb for stop in colormaps[palette] ])
+		positions = np.linspace(0.0, 1.0, len(stops))
+		table = np.array([ np.interp( np.linspace(0.0, 1.0, nColors), positions, stops[:, channel] ) for channel in range(0, 3) ]).T
+		table = np.round(table * 255)
+	else:
+		stops = [ colour.Color( stop.strip() ) for stop in palette.split(',') ]
+		if len(stops) < 2:
+			raise Exception("A palette needs two color stops at least, or a colormap name: " + palette)
+		
+		#Create range of colors between each pair of stops, which share
+		#the color of the stop between them
+		degrade = []
+		segments = len(stops) - 1
+		for i in range(0, segments):
+			count = (nColors - 1) * (i + 1) // segments - (nColors - 1) * i // segments
+			degrade += list( stops[i].range_to(stops[i + 1], count + 1) )[(1 if i > 0 else 0):]
+		table = [ [ int(j*255) for j in color.rgb ] for color in degrade ]
+	
+	colorTables[(palette, nColors)] = np.array(table, dtype=np.uint8)
+	return colorTables[(palette, nColors)]
+
+def getProgressBar(quiet = False):
+	"""Progress bar of the drawing, writing nowhere if quiet"""
+	fd = open(os.devnull, 'w') if quiet else sys.stderr
+	return ProgressBar(maxval=steps, widgets=[Bar('=', '[', ']'), ' ', Percentage()], fd=fd)
+
+def drawArtwork(args, bar, stream = None):
+	"""Draw the lines or circles of an artwork on an image
+
+    Keyword arguments:
+    args -- Dictionary with the command line parameters of the artwork
+    bar -- Status bar to show progress of the drawing
+    stream -- File object where the raw frames of an animation are written
+    Return the image, or None if it was written by tiles on the output file
+    """
+	
 	#Get command line parameters
 	image_size = args['s']
 	antialiasing = args['a']
 	supersampling = args['S']
+	tile_size = args['t']
+	workers = args['j'] if args['j'] is not None else multiprocessing.cpu_count()
 	
-	#To avoid running out of memory, do not allow
-	#big supersampling factors
-	if supersampling > 10: 
-		print "Supersampling factors is advised not to be greater than 10."
-		supersampling = 10
-		
 	n_elements = args['n']
 	base_element = args['e']
 	output_file = args['o'] 	
-	init_color = args['c']
-	end_color = args['C']
+	palette = args['p'] if args['p'] is not None else args['c'] + "," + args['C']
 	verbose = args['v']
+	blending = args['m']
+	tone = (args['T'], args['g'])
+	
+	if base_element not in ("line", "circle"):
+		raise Exception("Base element argument should be either [line|circle]")
+	if blending not in ("over", "add"):
+		raise Exception("Blending argument should be either [over|add]")
+	if tone[0] not in ("linear", "log", "gamma"):
+		raise Exception("Tone mapping argument should be either [linear|log|gamma]")
+	if blending == "add" and not antialiasing:
+		raise Exception("Added up elements are only drawn with antialiasing")
+	
+	#Elements added up are accumulated on a color sum and a density
+	adding = blending == "add"
+	
+	#Evaluated parametrizations are reused from the cache if given
+	cache = None
+	if args['cache'] is not None:
+		cache = GeometryCache(args['cache'], args['cache_size'] * 1024 * 1024)
+	
+	#The frames of an animation are taken as the elements are drawn
+	frames = None
+	if args['frames'] is not None:
+		frames = Frames(args['frames'] if args['frames'] != '-' else None, stream)
 	
 	#To avoid cropping circles we have to add an extra space on the
-	#image size.
-	if base_element == "circle":
+	#image size. The antialiased circles are drawn on an extended
+	#coordinate space instead
+	if base_element == "circle" and not antialiasing:
 		image_size = image_size*(2)
-		
-	#If we use antialasing for better resolution, we create the plot
-	#on a bigger image and then downsize the result
-	if antialiasing:
-		super_size = image_size*supersampling
-	else:
-		super_size = image_size
+	
+	#Images larger than a tile are never in memory at once, they are
+	#written on the output file by bands of tiles
+	tiled = antialiasing and tile_size > 0 and image_size > tile_size
+	if tiled and (output_file is None or not output_file.lower().endswith('.png')):
+		raise Exception("Images larger than a tile are written by tiles, give a .png output file with -o")
+	if frames is not None and (tiled or not antialiasing):
+		raise Exception("Animations are drawn with antialiasing on a single tile, give a larger tile size with -t")
 	
 	#Print description if verbose is asked
 	if verbose:
@@ -178,70 +941,228 @@ def main():
 		print "Image size:", image_size, "x", image_size, "pixels."
 		
 		if antialiasing:
-			print "Using antialiasing with downsizing factor of", supersampling
+			print "Using antialiasing with lines of width 1 /", supersampling
 		
-		print "Color degrade from", init_color, "to", end_color
+		if adding:
+			print "Adding up elements with", tone[0], "tone mapping"
+		
+		if tiled:
+			print "Drawing by tiles of", tile_size, "x", tile_size, "pixels on", workers, "processes"
+		
+		if frames is not None:
+			print "Animation with a frame every", args['frame_every'], "elements"
+		
+		if cache is not None:
+			print "Reusing evaluated parametrizations from", args['cache']
+		
+		print "Color palette", palette
 		
 		if output_file is not None:
 			print "Saving result on file", output_file
 	
-	#Set up a progress bar to show calculations
-	bar = ProgressBar(maxval=steps, widgets=[Bar('=', '[', ']'), ' ', Percentage()])
 	bar.start()
 	
-	#Create the bitmap which will contain the resulting image
-	img = Image.new( 'RGB', (super_size, super_size), "white")
+	#Create the bitmap which will contain the resulting image, or the
+	#float buffer where the antialiased elements are drawn, but for tiles
+	density = None
+	if antialiasing and not tiled and adding:
+		buffer = np.zeros( (image_size, image_size, 3), dtype=np.float32 )
+		density = np.zeros( (image_size, image_size), dtype=np.float32 )
+	elif antialiasing and not tiled:
+		buffer = np.full( (image_size, image_size, 3), 255.0, dtype=np.float32 )
+	elif not antialiasing:
+		img = Image.new( 'RGB', (image_size, image_size), "white")
 		
-	#Create range of colors
-	nColors = 256
-	init_color = colour.Color(init_color)
-	end_color = colour.Color(end_color)	
-	rainbow = list( init_color.range_to(end_color, nColors) )
+	#Get table of colors
+	rainbow = getColorTable(palette)
 	
 	#For each kind of elements
 	if base_element == "line":		
 		#Get parametrization from command line
-		parametrization = (args["X1"], args["Y1"], args["X2"], args["Y2"])
+		parametrization = getParametrization( (args["X1"], args["Y1"], args["X2"], args["Y2"]) )
+		if cache is not None:
+			parametrization = CachedParametrization(parametrization, base_element, cache)
 		
 		if verbose:
-			print "Parametrization:", parametrization
+			print "Parametrization:", parametrization.formulas
 			
 		#If the base element are lines
-		drawLines(img, parametrization, n_elements, rainbow, bar)
+		if tiled or frames is not None:
+			(elements, width) = ( lineElements(parametrization, n_elements, image_size), 1.0 / supersampling )
+		elif antialiasing:
+			rasterLines(buffer, parametrization, n_elements, rainbow, bar, 1.0 / supersampling, density)
+		else:
+			drawLines(img, parametrization, n_elements, rainbow, bar)
 			
-	elif base_element == "circle":
+	else:
 		#Get parametrization from command line
-		parametrization = (args["Xc"], args["Yc"], args["R"])
+		parametrization = getParametrization( (args["Xc"], args["Yc"], args["R"]) )
+		if cache is not None:
+			parametrization = CachedParametrization(parametrization, base_element, cache)
 		
 		if verbose:
-			print "Parametrization:", parametrization
+			print "Parametrization:", parametrization.formulas
 			
 		#If the base element are circles
-		drawCircles(img, parametrization, n_elements, rainbow, bar)
-		
-	else:
-		parser.print_help()
-		raise("Base element argument should be either [line|circle]")
-		sys.exit(2)
+		#Circles were drawn on an image twice as large, so they
+		#are half as wide as lines
+		if tiled or frames is not None:
+			(elements, width) = ( circleElements(parametrization, n_elements, image_size), 0.5 / supersampling )
+		elif antialiasing:
+			rasterCircles(buffer, parametrization, n_elements, rainbow, bar, 0.5 / supersampling, density)
+		else:
+			drawCircles(img, parametrization, n_elements, rainbow, bar)
 	
-	print ""
+	#Draw the tiles, stitched on the output file as they are done
+	if tiled:
+		writePNG(output_file, image_size, image_size, tileBands(elements, elementColors(rainbow, n_elements), width, image_size, tile_size, workers, bar, tone if adding else None))
+		bar.finish()
+		return None
+	
+	#Draw the animation, frame by frame, on the same buffer
+	if frames is not None:
+		animate(buffer, elements, elementColors(rainbow, n_elements), width, max(args['frame_every'], 1), frames, bar, density, tone)
 	
-	#To avoid antialiasing, we downsample the image with an
-	#Antialias filter
+	bar.finish()
+	
+	#Map the density of the added up elements to the image, or round
+	#the antialiased image to 8 bits per channel
 	if antialiasing:
-		#In case of circle, we have to reduce to half the original size
-		#since we created larger image to avoid circle cropping
-		if base_element == "circle":
-			image_size = image_size / 2	
-			
-		img = img.resize((image_size, image_size), Image.ANTIALIAS)			
+		img = Image.fromarray( bufferImage(buffer, density, tone) )
+	return img
+
+def readManifest(path, args):
+	"""Read the artworks of a batch from a manifest file
+
+	The manifest (.json, or .toml with the toml package) is either a list
+	of artworks or an object with a list of "artworks" and an optional
+	table of "defaults" for all of them. Each artwork is a table with the
+	command line parameters, by their names without the dash, and it must
+	have an output file "o":
+
+	{"defaults": {"n": 25000, "c": "red", "C": "blue"},
+	 "artworks": [{"o": "artwork3.png", "e": "circle", "R": "1.0/4.0*cos(40.0*pi*k/n)**2"}]}
+
+    Keyword arguments:
+    path -- File name of the manifest
+    args -- Dictionary with the command line parameters, the defaults of the defaults
+    Return a list with the dictionary of parameters of each artwork
+    """
+	with open(path) as f:
+		if path.lower().endswith('.toml'):
+			try:
+				import toml
+			except ImportError:
+				raise Exception("Reading .toml manifests needs the toml package, or use a .json manifest")
+			manifest = toml.load(f)
+		else:
+			manifest = json.load(f)
+	
+	if isinstance(manifest, list):
+		manifest = { 'artworks' : manifest }
+	
+	artworks = []
+	for artwork in manifest.get('artworks', []):
+		parameters = dict(args)
+		for key, value in manifest.get('defaults', {}).items() + artwork.items():
+			if key not in args or key in ('b', 'j'):
+				raise Exception("Unknown parameter '%s' on manifest %s" % (key, path))
+			parameters[str(key)] = str(value) if isinstance(value, unicode) else value
+		if parameters['o'] is None:
+			raise Exception("Every artwork of manifest %s needs an output file 'o'" % path)
+		if parameters['frames'] == '-':
+			raise Exception("The artworks of manifest %s write their frames on directories, not on stdout" % path)
+		artworks.append(parameters)
+	return artworks
+
+def saveArtwork(args):
+	"""Draw an artwork of a batch, quietly, and save it on its output file.
+	The worker processes of a batch keep the compiled formulas and the
+	color tables of their previous artworks.
+	Return the output file, and the error message if the artwork failed
+	"""
+	#Tiles are drawn on the worker process itself
+	args = dict(args, v = False, j = 1)
+	try:
+		img = drawArtwork(args, getProgressBar(quiet = True))
+		if img is not None:
+			img.save(args['o'])
+	except Exception as error:
+		return (args['o'], str(error))
+	return (args['o'], None)
+
+def drawBatch(artworks, workers, verbose):
+	"""Draw the artworks of a batch on a pool of worker processes
+
+    Keyword arguments:
+    artworks -- List with the dictionary of parameters of each artwork
+    workers -- Number of worker processes
+    verbose -- Print each artwork as it is saved
+    Return the number of artworks that failed
+    """
+	bar = getProgressBar()
+	bar.start()
+	failed = 0
+	pool = multiprocessing.Pool(workers)
+	try:
+		for done, (output_file, error) in enumerate( pool.imap_unordered(saveArtwork, artworks) ):
+			if error is not None:
+				failed += 1
+				print "\nFailed artwork", output_file, ":", error
+			elif verbose:
+				print "\nSaved artwork", output_file
+			bar.update( int( float(done + 1) / len(artworks) * steps) )
+	finally:
+		pool.terminate()
+		pool.join()
+	bar.finish()
+	return failed
+
+def main():
+	"""Main method of the program. Parse the command line argumen
+	and draw the lines or circles on the image. Show the image and
+	eventually save the result in an output file. With a manifest,
+	draw all its artworks on their output files instead.
+    """
+    
+	#Parse command line arguments
+	parser = getCommandLineParser()
+	#parser.print_help()
+	#Get arguments as a hash table
+	args = vars( parser.parse_args() )
+	
+	#Raw frames take stdout, so messages go to stderr
+	stream = None
+	if args['frames'] == '-':
+		stream = sys.stdout
+		sys.stdout = sys.stderr
+	
+	#Draw a batch of artworks, with the command line parameters as defaults
+	if args['b'] is not None:
+		artworks = readManifest(args['b'], args)
+		workers = args['j'] if args['j'] is not None else multiprocessing.cpu_count()
+		if args['v']:
+			print "Drawing", len(artworks), "artworks of", args['b'], "on", workers, "processes"
+		failed = drawBatch(artworks, workers, args['v'])
+		if failed > 0:
+			sys.exit(1)
+		return
+	
+	img = drawArtwork(args, getProgressBar(), stream)
+	
+	print ""
+	
+	#The image was written by tiles
+	if img is None:
+		return
 		
-	#Show the result
-	img.show()
+	#Show the result, unless taking the frames of an animation
+	if args['frames'] is None:
+		img.show()
 	
 	#Save the image if we specified an output file	
-	if output_file is not None:
-		img.save(output_file)
+	if args['o'] is not None:
+		img.save(args['o'])
 
 
 if __name__ == "__main__":